@@ -0,0 +1,366 @@
+# simulation benchmarks, run from predprey/ like main.py:
+#   python bench.py spatial --sizes 10 100 1000 10000
+#   python bench.py all --json bench.json --baseline baseline.json --threshold 0.2
+#   python bench.py engines  # exits 1 unless both engines give exactly the same seeded run
+#   python bench.py convergence --mode pred --converge-episodes 5000 --seeds 0 1 2
+#   SDL_VIDEODRIVER=dummy python bench.py render  # drawing needs a display, the dummy one works headless
+# every result is seconds per call/frame/episode (or to converge), so larger is slower
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+import numpy as np
+import pygame
+
+import main
+from resources.mobs import angle, distance
+from resources.kernels import BACKENDS
+from resources.vector import VectorWorld
+from resources.render import Renderer, Frame
+
+
+SIZES = (10, 100, 1000, 10000)
+FRAMES = 5
+MAX_SCAN = 2000  # largest world timed without a spatial index (O(N^2) per frame)
+SEED = 0
+MICRO_CALLS = 2000
+MICRO_FOOD = 100  # food around the timed mobs, at the default density
+EPISODES = 50
+THRESHOLD = 0.2  # slowdown over the baseline reported as a regression
+KERNEL_WORLDS = 256  # VectorWorld copies stepped together
+KERNEL_FRAMES = 200
+CONVERGE_EPISODES = 3000
+CONVERGE_SEEDS = (0, 1, 2)
+LEARNERS = ('one-step', 'n-step', 'lambda')
+RENDER_MOBS = (300, 100, 10)  # food, prey, predators in the drawn world
+RENDER_FRAMES = 100
+ENGINE_EPISODES = 40
+ENGINE_SIDE = 150  # a small world, so mobs often start on the same spot
+
+
+def build_world(food=0, prey=0, pred=0, engine='objects', spatial=False):
+    # keep the density of the default run (100 food in 400 x 400) as the world grows
+    side = int(400 * max(food, 1) ** 0.5 / 10)
+    main.WIDTH = side
+    main.HEIGHT = side
+    main.ENGINE = engine
+    main.SPATIAL = spatial
+    main.EPISODES = 1
+
+    main.seed_rng(SEED)
+    with contextlib.redirect_stdout(io.StringIO()):
+        mobs, world, epsilon, rewards = main.sim_init(food=food, prey=prey, pred=pred)
+    main.reset_mobs(mobs=mobs)
+    if world:
+        world.pull()
+
+    return mobs, world, rewards
+
+
+def time_frames(mobs=None, world=None, rewards=None, frames=FRAMES, epsilon=0.5):
+    start = time.perf_counter()
+    for k in range(frames):
+        main.mob_update(mode='run', mobs=mobs, epsilon=epsilon, rewards=rewards, episode=0, world=world)
+    return (time.perf_counter() - start) / frames
+
+
+def spatial_scaling(sizes=SIZES, frames=FRAMES, max_scan=MAX_SCAN):
+    results = []
+    for size in sizes:
+        counts = {'food': size, 'prey': size // 100 + 1, 'pred': size // 1000 + 1}
+        for engine in ('objects', 'arrays'):
+            for spatial in (False, True):
+                if not spatial and size > max_scan:
+                    continue
+                mobs, world, rewards = build_world(engine=engine, spatial=spatial, **counts)
+                per_frame = time_frames(mobs=mobs, world=world, rewards=rewards, frames=frames)
+                results.append({'name': 'frame/{}{}/{}'.format(engine, '+spatial' if spatial else '', size),
+                                'mobs': sum(counts.values()), 'seconds': per_frame})
+                print('{:<32} {:>7} mobs  {:>10.5f} s/frame'.format(results[-1]['name'], results[-1]['mobs'], per_frame))
+    return results
+
+
+def time_call(fn=None, calls=MICRO_CALLS, repeat=3):
+    # best of repeat runs, in seconds per call
+    best = float('inf')
+    for r in range(repeat):
+        start = time.perf_counter()
+        for c in range(calls):
+            fn()
+        best = min(best, (time.perf_counter() - start) / calls)
+    return best
+
+
+def micro(calls=MICRO_CALLS):
+    mobs, world, rewards = build_world(food=MICRO_FOOD, prey=1, pred=1)
+    prey = mobs['Prey'][0]
+    pred = mobs['Predator'][0]
+    q_key = prey.observe(mobs=mobs)
+    offset = (12.5, -30.0)
+
+    timed = {'micro/observe/prey': lambda: prey.observe(mobs=mobs),
+             'micro/observe/pred': lambda: pred.observe(mobs=mobs),
+             'micro/check/prey': lambda: prey.check(mobs=mobs, mx=1, my=1),
+             'micro/update_q/prey': lambda: prey.update_q(mobs=mobs, q_key=q_key, choice=3, reward=(-2, 0)),
+             'micro/get_quad': lambda: prey.q_table.get_quad(angle(offset)),
+             'micro/get_range': lambda: prey.q_table.get_range(distance(offset)),
+            }
+
+    results = []
+    for name, fn in timed.items():
+        results.append({'name': name, 'mobs': MICRO_FOOD + 2, 'seconds': time_call(fn, calls=calls)})
+        print('{:<32} {:>7} mobs  {:>10.2f} us/call'.format(name, results[-1]['mobs'], results[-1]['seconds'] * 10**6))
+    return results
+
+
+def episodes(count=EPISODES, engine='objects'):
+    # end-to-end headless training, as main.py runs it
+    results = []
+    for mode, scenario in main.SCENARIOS.items():
+        main.HEADLESS = True
+        main.SAVE_Q = False
+        main.WORKERS = 1
+        main.REWARD_LOG = False
+        main.VERBOSITY = 'quiet'
+        main.ENGINE = engine
+        main.SPATIAL = False
+        main.EPISODES = count
+        main.seed_rng(SEED)
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            main.train(mode=mode, **scenario)
+        per_episode = (time.perf_counter() - start) / count
+        results.append({'name': 'episode/{}/{}'.format(engine, mode), 'episodes': count, 'seconds': per_episode})
+        print('{:<32} {:>7} eps   {:>10.2f} episodes/sec'.format(results[-1]['name'], count, 1 / per_episode))
+    return results
+
+
+def engine_run(engine='objects', spatial=False, seed=SEED, count=ENGINE_EPISODES, side=ENGINE_SIDE):
+    # a seeded headless run on one engine: (seconds per episode, its Q tables and reward records)
+    main.HEADLESS = True
+    main.SAVE_Q = False
+    main.WORKERS = 1
+    main.REWARD_LOG = False
+    main.VERBOSITY = 'quiet'
+    main.ENGINE = engine
+    main.SPATIAL = spatial
+    main.EPISODES = count
+    main.WIDTH = side
+    main.HEIGHT = side
+    main.seed_rng(seed)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        mobs, rewards = main.run(food=60, prey=6, pred=2)
+    seconds = (time.perf_counter() - start) / count
+    return seconds, [np.array(mob.q_table.values) for mob_type in ('Prey', 'Predator') for mob in mobs[mob_type]] + [rewards.records()]
+
+
+def engines(count=ENGINE_EPISODES, seeds=CONVERGE_SEEDS):
+    # the arrays engine must give exactly the objects engine's run, with the index and without
+    # (the index itself changes trajectories, see MobIndex, so each is checked against its own objects run)
+    results = []
+    for spatial in (False, True):
+        times = {'objects': [], 'arrays': []}
+        mismatched = []
+        for seed in seeds:
+            seconds, base = engine_run('objects', spatial, seed=seed, count=count)
+            times['objects'].append(seconds)
+            seconds, produced = engine_run('arrays', spatial, seed=seed, count=count)
+            times['arrays'].append(seconds)
+            if not all(np.array_equal(a, b) for a, b in zip(base, produced)):
+                mismatched.append(seed)
+        for engine, seconds in times.items():
+            same = engine == 'objects' or not mismatched
+            results.append({'name': 'engine/{}{}'.format(engine, '/spatial' if spatial else ''), 'episodes': count,
+                            'seconds': float(np.mean(seconds)), 'identical': same})
+            print('{:<32} {:>7} eps   {:>10.2f} episodes/sec  {}'.format(results[-1]['name'], count, 1 / results[-1]['seconds'],
+                  'identical' if same else 'MISMATCH (seeds {})'.format(', '.join(map(str, mismatched)))))
+    return results
+
+
+def kernel_run(backend='numpy', k=KERNEL_WORLDS, frames=KERNEL_FRAMES):
+    # the same seeded VectorWorld run on one kernel backend: (seconds per frame, everything it produced)
+    main.seed_rng(SEED)
+    with contextlib.redirect_stdout(io.StringIO()):
+        mobs = main.init_mobs(food=100, prey=(5, False), pred=(2, False))
+    vec = VectorWorld(mobs=mobs, k=k, dims=(400, 400), frames=100, seed=SEED, backend=backend)
+    obs = vec.reset()
+    vec.step(vec.choose(obs, epsilon=0.5))  # compile outside the timing
+
+    obs = vec.reset()
+    produced = []
+    start = time.perf_counter()
+    for frame in range(frames):
+        obs, rewards, done = vec.step(vec.choose(obs, epsilon=0.5))
+        produced += [obs, rewards, done]
+    elapsed = time.perf_counter() - start
+    return elapsed / frames, produced + [vec.x, vec.y, vec.health, vec.alive]
+
+
+def kernel_speedup(k=KERNEL_WORLDS, frames=KERNEL_FRAMES):
+    # VectorWorld frames on each available backend, checked against the NumPy results
+    results = []
+    base_seconds, base = kernel_run('numpy', k=k, frames=frames)
+    for backend in BACKENDS:
+        seconds, produced = (base_seconds, base) if backend == 'numpy' else kernel_run(backend, k=k, frames=frames)
+        same = all(np.array_equal(a, b) for a, b in zip(base, produced))
+        results.append({'name': 'kernels/{}'.format(backend), 'worlds': k, 'seconds': seconds, 'identical': same})
+        print('{:<32} {:>7} worlds {:>10.1f} world-frames/sec  x{:.2f}  {}'.format(
+            results[-1]['name'], k, k / seconds, base_seconds / seconds, 'identical' if same else 'MISMATCH'))
+    if 'numba' not in BACKENDS:
+        print('numba is not installed: only the NumPy kernels were timed')
+    return results
+
+
+def render(counts=RENDER_MOBS, frames=RENDER_FRAMES):
+    # the render thread's work per shown frame, for frames recorded off a seeded world
+    food, prey, pred = counts
+    mobs, world, rewards = build_world(food=food, prey=prey, pred=pred)
+    main.Mob.record_moves = True
+    recorded = []
+    for frame in range(frames):
+        main.mob_update(mode='run', mobs=mobs, epsilon=0.5, rewards=rewards, episode=0)
+        recorded.append(Frame(episode=0, frame=frame + 1, mobs=mobs))
+
+    pygame.init()
+    renderer = Renderer(pygame.display.set_mode((main.WIDTH, main.HEIGHT)))
+    renderer.draw(recorded[0])  # the first frame is drawn whole
+    start = time.perf_counter()
+    for frame in recorded[1:]:
+        renderer.draw(frame)
+    seconds = (time.perf_counter() - start) / (frames - 1)
+    renderer.close()
+    pygame.display.quit()
+
+    results = [{'name': 'render/frame', 'mobs': sum(counts), 'seconds': seconds}]
+    print('{:<32} {:>7} mobs  {:>10.1f} frames/sec'.format(results[-1]['name'], sum(counts), 1 / seconds))
+    return results
+
+
+def first_reaching(stream=(), target=0, window=1):
+    # episodes trained when the moving average first reaches target, or inf
+    if len(stream) < window:
+        return float('inf')
+    moving_avg = np.convolve(stream, np.ones(window) / window, mode='valid')
+    hits = np.flatnonzero(moving_avg >= target)
+    return hits[0] + window if hits.size else float('inf')
+
+
+def convergence(count=CONVERGE_EPISODES, mode='pred', seeds=CONVERGE_SEEDS, target=None, engine='objects'):
+    # headless training with each Q learner until the learning species' moving-average reward reaches target;
+    # with no target, halfway from the one-step learner's first to its best moving average
+    streams = {}
+    per_episode = {}
+    for learner in LEARNERS:
+        main.HEADLESS = True
+        main.SAVE_Q = False
+        main.WORKERS = 1
+        main.REPLAY = False
+        main.REWARD_LOG = False
+        main.VERBOSITY = 'quiet'
+        main.ENGINE = engine
+        main.SPATIAL = False
+        main.EPISODES = count
+        main.PREY_LEARNER = main.PRED_LEARNER = learner
+        streams[learner] = []
+        start = time.perf_counter()
+        for seed in seeds:
+            main.seed_rng(seed)
+            with contextlib.redirect_stdout(io.StringIO()):
+                mobs, rewards, valued_customer = main.train(mode=mode, **main.SCENARIOS[mode])
+            streams[learner].append(rewards.history(mobs[valued_customer][0]))
+        per_episode[learner] = (time.perf_counter() - start) / (count * len(seeds))
+    main.PREY_LEARNER = main.PRED_LEARNER = 'one-step'
+
+    window = min(main.M_AVG, count)
+    if target is None:
+        averages = [np.convolve(stream, np.ones(window) / window, mode='valid') for stream in streams['one-step']]
+        first = np.mean([avg[0] for avg in averages])
+        target = first + (np.mean([avg.max() for avg in averages]) - first) / 2
+    print('{} target: moving average ({} episodes) of {:.2f}'.format(mode, window, target))
+
+    results = []
+    for learner in LEARNERS:
+        needed = np.mean([first_reaching(stream, target, window) for stream in streams[learner]])
+        results.append({'name': 'converge/{}/{}'.format(mode, learner), 'episodes': needed, 'target': target,
+                        'seconds': needed * per_episode[learner]})
+        print('{:<32} {:>9.0f} eps  {:>10.2f} s to target'.format(results[-1]['name'], needed, results[-1]['seconds']))
+    return results
+
+
+def compare(results=(), baseline=(), threshold=THRESHOLD):
+    # report each result against the baseline run of the same name; returns the regressions
+    before = {result['name']: result['seconds'] for result in baseline}
+    regressions = []
+    print('\n{:<32} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline', 'now', 'ratio'))
+    for result in results:
+        if result['name'] not in before:
+            continue
+        ratio = result['seconds'] / before[result['name']] if before[result['name']] > 0 else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(result['name'])
+        print('{:<32} {:>12.3e} {:>12.3e} {:>8.2f}{}'.format(result['name'], before[result['name']], result['seconds'], ratio, flag))
+    return regressions
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description='''Predator/Prey simulation benchmarks''')
+    parser.add_argument('suite', help='benchmark to run', choices=('micro', 'spatial', 'episodes', 'engines', 'kernels', 'convergence', 'render', 'all'))
+    parser.add_argument('--sizes', help='food counts to time', nargs='+', type=int, default=SIZES)
+    parser.add_argument('--frames', help='frames timed per world', type=int, default=FRAMES)
+    parser.add_argument('--max-scan', help='largest world timed without an index', type=int, default=MAX_SCAN)
+    parser.add_argument('--calls', help='calls timed per micro-benchmark', type=int, default=MICRO_CALLS)
+    parser.add_argument('--episodes', help='training episodes timed per mode', type=int, default=EPISODES)
+    parser.add_argument('--engine', help='world engine for the episode timings', choices=('objects', 'arrays'), default='objects')
+    parser.add_argument('--worlds', help='VectorWorld copies for the kernel timings', type=int, default=KERNEL_WORLDS)
+    parser.add_argument('--mode', help='training scenario for convergence', choices=tuple(main.SCENARIOS), default='pred')
+    parser.add_argument('--converge-episodes', help='training episodes per learner and seed', type=int, default=CONVERGE_EPISODES)
+    parser.add_argument('--seeds', help='seeds averaged for convergence, and run on both engines', nargs='+', type=int, default=CONVERGE_SEEDS)
+    parser.add_argument('--target', help='moving-average reward to converge to (default: halfway to the one-step best)', type=float, default=None)
+    parser.add_argument('--json', help='write results to this file', default=None)
+    parser.add_argument('--baseline', help='earlier --json results to compare against', default=None)
+    parser.add_argument('--threshold', help='fractional slowdown counted as a regression', type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    results = []
+    if args.suite in ('micro', 'all'):
+        results += micro(calls=args.calls)
+    if args.suite in ('spatial', 'all'):
+        results += spatial_scaling(sizes=args.sizes, frames=args.frames, max_scan=args.max_scan)
+    if args.suite in ('episodes', 'all'):
+        results += episodes(count=args.episodes, engine=args.engine)
+    if args.suite in ('engines', 'all'):
+        results += engines(seeds=args.seeds)
+    if args.suite in ('kernels', 'all'):
+        results += kernel_speedup(k=args.worlds)
+    if args.suite == 'render':  # needs a display, so not part of all
+        results += render()
+    if args.suite == 'convergence':  # minutes, so not part of all
+        results += convergence(count=args.converge_episodes, mode=args.mode, seeds=args.seeds, target=args.target, engine=args.engine)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    mismatched = [result['name'] for result in results if result.get('identical') is False]
+    if mismatched:
+        print('\nresults differ from the objects engine / NumPy kernels: {}'.format(', '.join(mismatched)))
+        sys.exit(1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), threshold=args.threshold)
+        if regressions:
+            print('\n{} regression(s) over {:.0%}: {}'.format(len(regressions), args.threshold, ', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,55 @@
+# convert pickled .Q tables to the binary Q table format, run from predprey/ like main.py:
+#   python convert.py resources/q_tables/Prey-7965313.Q resources/q_tables/Predator-8637585.Q
+
+import argparse
+import os
+import pickle
+import numpy as np
+
+from resources.mobs import Q_table, Prey, Predator
+
+
+SPECIES = {'Prey': Prey, 'Predator': Predator}
+
+
+def table_geometry(saved=None):
+    # (slices, bands, actions) of a pickled table, from its keys or its array shape
+    if isinstance(saved, np.ndarray):
+        return saved.shape[0] - 1, saved.shape[1] - 1, saved.shape[-1]
+
+    states = [state for q_key in saved for state in Q_table.saved_key(q_key)]
+    quads = [quad for quad, band in states if quad is not None]
+    bands = [band for quad, band in states if band is not None]
+    actions = len(next(iter(saved.values())))
+    return max(quads) + 1, max(bands) + 1, actions
+
+
+def convert(filename=None, species=None, out=None):
+    species = species or SPECIES[os.path.basename(filename).split('-')[0]]
+    with open(filename, 'rb') as f:  # pickle: only convert files you trust
+        saved = pickle.load(f)
+
+    slices, bands, actions = table_geometry(saved)
+    q_table = Q_table(r=species.sight, bands=bands, slices=slices, actions=actions)
+    q_table.values = q_table.from_saved(saved)
+
+    info = species.q_info()
+    info.update({'bands': bands, 'slices': slices, 'converted_from': os.path.basename(filename)})
+    out = out or '{}.{}'.format(os.path.splitext(filename)[0], Q_table.EXT)
+    print('Converting {} to {}'.format(filename, out))
+    q_table.write(out, info=info)
+    return out
+
+
+def main_convert():
+    parser = argparse.ArgumentParser(description='''Convert pickled Q tables to the binary format''')
+    parser.add_argument('tables', help='pickled .Q files', nargs='+')
+    parser.add_argument('--species', help='species the tables belong to (default: from the file name)', choices=tuple(SPECIES), default=None)
+    args = parser.parse_args()
+
+    for filename in args.tables:
+        convert(filename, species=SPECIES[args.species] if args.species else None)
+
+
+if __name__ == '__main__':
+    main_convert()
@@ -4,36 +4,75 @@
 
 import pygame
 import time
-import random
 import os
 import argparse
+import contextlib
+import cProfile
+import multiprocessing
+from multiprocessing import shared_memory
 import numpy as np
-import matplotlib.pyplot as plt
-
-from resources.mobs import Predator, Prey, Food
+from matplotlib.figure import Figure
+
+from resources.mobs import Mob, Predator, Prey, Food
+from resources.world import World
+from resources.spatial import MobIndex
+from resources.timing import PhaseTimer
+from resources.checkpoint import Checkpointer, load_checkpoint
+from resources.rewards import RewardLog
+from resources.logs import LogWriter, Progress, TraceBuffer
+from resources.replay import ReplayBuffer
+from resources.render import Renderer, Recorder, FrameWriter, Frame
+from resources.rng import WorldRNG
 
 ''' TODO
 
     condense/commonize training and running
-    multi-step future_q
     2 q_tables for mobs (1 for target, 1 for flee; prioritize flee for action)
 '''
 
 
-pygame.init()
-
 MODE='prey'
+HEADLESS = False  # never touch the display: no surface, fonts or frame limiting
+ENGINE = 'objects'  # 'objects': per-mob methods, 'arrays': batched World engine
+SPATIAL = False  # grid index for neighbour queries, rebuilt every frame
+WORKERS = 1  # training processes sharing one lock-free Q table (Hogwild); more than 1 implies headless
+SHARED_Q = False  # one Q table per species, read and updated by every mob of it
+SEED = None  # WorldRNG seed; parallel workers use SEED + worker
+TIMER = None  # PhaseTimer when per-phase timing is on (--timing)
+PROFILE = False  # cProfile every shown episode into PROFILES
+CHECKPOINT_EVERY = 0  # episodes between checkpoints, 0 for never
+CHECKPOINT_SECS = 0  # seconds between checkpoints, 0 for never
+RESUME = False  # continue from the mode's checkpoint
+PREY_LEARNER = 'one-step'  # Q update per species: one-step, n-step or lambda (Q(lambda))
+PRED_LEARNER = 'one-step'
+N_STEP = 4  # rewards per n-step return
+TRACE_DECAY = 0.8  # lambda for Q(lambda)
+REPLAY = False  # record transitions and learn from sampled batches instead of after every action
+REPLAY_SIZE = 100000  # transitions kept per Q table
+REPLAY_BATCH = 256  # transitions per batched update
+REPLAY_EVERY = 64  # transitions recorded between batched updates
+REWARD_LOG = True  # stream per-episode rewards to REWARDS/<mode>.rewards instead of keeping them in memory
+VERBOSITY = 'progress'  # quiet, progress (a summary line every PROGRESS_SECS), or episodes (every episode's rewards)
+PROGRESS_SECS = 5
 
 # resources
 RES = 'resources'
-LOG = open(os.path.join(RES, 'game.log'), 'w')
+LOG = None  # LogWriter for game.log, opened when run as a script
+CONSOLE = LogWriter()  # episode output, written to stdout off the sim thread
+PROGRESS = None  # Progress for the current run
+TRACE = 'pred.trace'  # per-action predator trace (--trace)
 
 # pygame setup
 WIDTH = 400  # 1080
 HEIGHT = 400  # 800
-gameDisplay = pygame.display.set_mode((WIDTH, HEIGHT))
-clock = pygame.time.Clock()
+gameDisplay = None  # created by render_init() unless running headless
+RENDERER = None  # draws shown episodes on its own thread, see render_init()
 FPS = 30
+RENDER_EVERY = 1  # draw every this many frames of a shown episode; more fast-forwards it
+RENDER_QUEUE = 256  # frames waiting to be drawn before newer ones are dropped
+RECORD = 0  # write every this many episodes to RECORDINGS offscreen, 0 for never; works headless
+RECORD_FORMAT = 'png'  # png (a file per frame) or raw (an RGB stream per episode)
+RECORDER = None  # Recorder while recording, see start_recording()
 
 # Q learning variables [DEFAULTS]
 EPISODES = 1000  # 22500  # with epsilon decay rate at 0.9998, this corresponds to <1% random moves
@@ -48,155 +87,428 @@ PREY_TABLE = False  # 'Prey-7965313'
 PRED_TABLE = False  # 'Predator-8637585'
 SAVE_Q = True
 
+# training scenarios by mode: what to spawn, and whether the prey moves (and so is the one learning)
+SCENARIOS = {'pred': {'food': 0, 'prey': (1, False), 'pred': 1},  # train the predator Q table
+             'prey': {'food': 1, 'prey': (1, True), 'pred': 0},  # train the prey Q table (target)
+             'evade': {'food': 0, 'prey': (1, True), 'pred': 1},  # train the prey Q table (flee)
+            }
+
+# module settings a training worker process needs from its parent
+WORKER_SETTINGS = ('WIDTH', 'HEIGHT', 'EPISODES', 'FRAMES', 'EPSILON', 'DECAY_RATE', 'ENGINE', 'SPATIAL',
+                   'PREY_TABLE', 'PRED_TABLE', 'HEADLESS', 'WORKERS', 'SHARED_Q', 'SEED', 'VERBOSITY', 'PROGRESS_SECS',
+                   'REPLAY', 'REPLAY_SIZE', 'REPLAY_BATCH', 'REPLAY_EVERY', 'PREY_LEARNER', 'PRED_LEARNER', 'N_STEP', 'TRACE_DECAY',
+                   'RECORD', 'RECORD_FORMAT')
+
 # plotting
 PLOTS = 'plots'
+PROFILES = 'profiles'
+CHECKPOINTS = 'checkpoints'
+REWARDS = 'rewards'
+RECORDINGS = 'recordings'
 M_AVG = 50
+PLOT_POINTS = 2000  # most buckets drawn per reward plot; longer runs are min/max decimated
+PLOT_EVERY = 0  # redraw the reward plots every this many episodes, 0 for only at the end
 
 # colors
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 
 
-def sim_init(food=0, prey=0, pred=0):
+def sim_init(food=0, prey=0, pred=0, log=None, append=False):
 
-    mobs = init_mobs(food=food, prey=(prey, PREY_TABLE), pred=(pred, PRED_TABLE))
+    mobs = init_mobs(food=food, prey=(prey, PREY_TABLE), pred=(pred, PRED_TABLE), shared=SHARED_Q)
+    world = World(mobs=mobs, dims=(WIDTH, HEIGHT), spatial=SPATIAL, timer=TIMER) if ENGINE == 'arrays' else None
+    if REPLAY:
+        attach_replays(mobs)
 
     epsilon = EPSILON
 
-    rewards = {}
-    for mob_type, mob_list in mobs.items():
-        for mob in mob_list:
-            rewards[mob] = [ 0 ] * EPISODES
+    rewards = RewardLog(mobs=mobs, filename=log, append=append, window=M_AVG, points=PLOT_POINTS)  # in memory when there is no log file
+    globals()['PROGRESS'] = Progress(writer=CONSOLE, interval=PROGRESS_SECS, episodes=EPISODES)
 
-    return mobs, epsilon, rewards
+    return mobs, world, epsilon, rewards
 
 
-def init_mobs(food=0, prey=(0, False), pred=(0, False)):
+def init_mobs(food=0, prey=(0, False), pred=(0, False), shared=False):
     mobs = {'Food': [],
             'Prey': [],
             'Predator': [],
            }
+    for species, learner in ((Prey, PREY_LEARNER), (Predator, PRED_LEARNER)):
+        species.learner, species.n_step, species.trace_decay = learner, N_STEP, TRACE_DECAY
+    prey_q = Prey.new_q_table(load=prey[1]) if shared and prey[0] > 0 else None
+    pred_q = Predator.new_q_table(load=pred[1]) if shared and pred[0] > 0 else None
     
     for f in range(food):
         mobs['Food'].append(Food(x=0, y=0))
     
     for p in range(prey[0]):
-        mobs['Prey'].append(Prey(x=0, y=0, load=prey[1]))
+        mobs['Prey'].append(Prey(x=0, y=0, load=prey[1], q_table=prey_q))
     
     for p in range(pred[0]):
-        mobs['Predator'].append(Predator(x=0, y=0, load=pred[1]))
+        mobs['Predator'].append(Predator(x=0, y=0, load=pred[1], q_table=pred_q))
     
     print('\n' + '='*60 + '\n')
     return mobs
 
 
+def attach_replays(mobs=None):
+    # one replay buffer per Q table, so a species-wide table pools every mob's transitions
+    for mob_type, name, q_table in unique_q_tables(mobs):
+        q_table.replay = ReplayBuffer(q_table=q_table, species=mobs[mob_type][0].__class__, capacity=REPLAY_SIZE,
+                                      batch=REPLAY_BATCH, every=REPLAY_EVERY, seed=Mob.rng.integers(0, 2**31))
+
+
+def end_learning(mobs=None):
+    # settle each mob's last transition of the episode: replayed, or the tail of a multi-step return
+    for mob_type, name, q_table in unique_q_tables(mobs):
+        if q_table.replay is not None:
+            q_table.replay.end_episode()
+    for mob_type, mob_list in mobs.items():
+        for mob in mob_list:
+            if mob.returns is not None:
+                mob.returns.end_episode()
+
+
 def reset_mobs(mobs=None, center=None):
+    Food.eaten = 0
+    points = iter(Mob.rng.positions(sum(len(mob_list) for mob_list in mobs.values()), WIDTH, HEIGHT))
     for mob_type, mob_list in mobs.items():
         for mob in mob_list:
-            x = random.randint(0, WIDTH)
-            y = random.randint(0, HEIGHT)
+            x, y = next(points)
             if mob_type == center:
                 x = WIDTH / 2
                 y = HEIGHT / 2
             mob.reset(x=x, y=y)
 
 
-def display_stats(episode, frame, mobs):
-    font = pygame.font.SysFont(None, 32)
-    
-    text = font.render('episode/frame: {}/{}'.format(episode, frame), True, WHITE)
-    gameDisplay.blit(text,(0, 0))
-    
-    for num, key in enumerate(mobs.keys()):
-        tally = 0
-        total = len(mobs[key])
-        for mob in mobs[key]:
-            tally = tally + 1 if mob.alive else tally
-        message = '{}: {}/{}'.format(key, tally, total)
-        text = font.render(message, True, WHITE)
-        gameDisplay.blit(text,(0, (num+1)*40))
+def render_init():
+    global gameDisplay, RENDERER
+
+    pygame.init()
+    gameDisplay = pygame.display.set_mode((WIDTH, HEIGHT))
+    RENDERER = Renderer(gameDisplay, fps=FPS, size=RENDER_QUEUE)
+
+
+def render_frame(episode=0, frame=0, mobs=None, last=False, pause=False, show=True, record=False):
+    # hand a frame to the render thread if shown (every RENDER_EVERY-th, and always the last of the episode)
+    # and to the recorder if recorded (all of them)
+    show = show and (last or frame % RENDER_EVERY == 0)
+    if not (show or record):
+        return
+    if TIMER: TIMER.mark()
+    snapshot = Frame(episode=episode, frame=frame, mobs=mobs, pause=pause)
+    if show:
+        RENDERER.publish(snapshot)
+    if record:
+        RECORDER.publish(snapshot)
+    if TIMER: TIMER.lap('render')
+
+
+def start_recording(mode='run'):
+    global RECORDER
+    if RECORD:
+        CONSOLE.flush()  # as for train_parallel, the recorder may be a forked process
+        RECORDER = Recorder(os.path.join(RES, RECORDINGS), name=mode, dims=(WIDTH, HEIGHT), fps=FPS, fmt=RECORD_FORMAT)
+
 
+def stop_recording():
+    # wait for every recorded frame to reach disk
+    global RECORDER
+    if RECORDER:
+        RECORDER.close()
+        RECORDER = None
 
-def mob_update(mode='run', mobs=None, epsilon=0, rewards=None, episode=0, allow_prey_movement=True):
+
+def report_speed(frames, start, episodes=0):
+    elapsed = time.perf_counter() - start
+    rate = frames / elapsed if elapsed > 0 else float('inf')
+    ep_rate = episodes / elapsed if elapsed > 0 else float('inf')
+    workers = ', {} workers'.format(WORKERS) if WORKERS > 1 else ''
+    print('Simulated {} frames/{} episodes in {:.2f}s ({:.1f} frames/sec, {:.2f} episodes/sec{}{})'.format(
+        frames, episodes, elapsed, rate, ep_rate, ', headless' if HEADLESS else '', workers))
+
+
+def mob_update(mode='run', mobs=None, epsilon=0, rewards=None, episode=0, allow_prey_movement=True, world=None):
     end_episode = False
     update_types = ('Food', 'Prey', 'Predator') if allow_prey_movement else ('Food', 'Predator')
     update_q_tables = ('Prey') if mode in ('prey', 'evade') else ('Predator') if mode in ('pred') else ('Prey', 'Predator')
     
+    if world:  # rewards are tallied by the world at the end of the episode
+        return world.step(epsilon=epsilon, update_types=update_types, update_q_tables=update_q_tables)
+    
+    lap = TIMER.lap if TIMER else None
+    if lap: TIMER.mark()
+    index = MobIndex(mobs=mobs) if SPATIAL else None
+    if lap and index: lap('index')
+    
+    # food is passive: it grows lazily by the frame count, and one eaten in an earlier frame ends the episode
+    if 'Food' in update_types:
+        Food.clock += 1
+    end_episode = Food.eaten > 0
     
     for mob_type, mob_list in mobs.items():
+        if mob_type == 'Food':
+            continue
         for mob in mob_list:
             if mob.alive and mob_type in update_types:
-                q_key = mob.observe(mobs=mobs)  # find the closest food/prey/predator
+                if lap: TIMER.mark()
+                q_key = mob.observe(mobs=mobs, index=index)  # find the closest food/prey/predator
+                if lap: lap('observe', mob_type)
                 mx, my, choice = mob.action(epsilon=epsilon, q_key=q_key, max_dims=(WIDTH, HEIGHT))  # take an action
-                reward, _ = mob.check(mobs=mobs, mx=mx, my=my)  # check to see what has happened
+                if lap: lap('action', mob_type)
+                reward, eaten = mob.check(mobs=mobs, mx=mx, my=my, index=index)  # check to see what has happened
+                if eaten and mob.target[0] == 'Food':
+                    Food.eaten += len(eaten)
+                if lap: lap('check', mob_type)
                 if mob_type in update_q_tables:
-                    mob.update_q(mobs=mobs, q_key=q_key, choice=choice, reward=reward)  # learn from what mob did
+                    mob.update_q(mobs=mobs, q_key=q_key, choice=choice, reward=reward, index=index)  # learn from what mob did
+                    if lap: lap('update_q', mob_type)
         
-                rewards[mob][episode] += (reward[0] + reward[1])  # tally for episode rewards
+                rewards.add(mob, reward[0] + reward[1])  # tally for episode rewards
             elif not mob.alive:
                 end_episode = True  # die when one of the mobs does
     
     return end_episode
 
 
-def display_mobs(show_this=False, mobs=None):
-    if not show_this:
+def world_sync(world=None, rewards=None, episode=0, end=False, moves=False):
+    if not world:
+        return
+    if TIMER: TIMER.mark()
+    if end:
+        world.push()
+        world.tally(rewards=rewards, episode=episode)
+    elif moves:  # the mobs are only read mid-episode to be drawn
+        world.push(moves=True)
+    if TIMER: TIMER.lap('sync')
+
+
+def episode_cleanup(episode, mobs, rewards, frames=0, epsilon=0):
+    if TIMER: TIMER.mark()
+    if VERBOSITY == 'episodes':
+        lines = ['Episode {}/{} completed at {}'.format(episode+1, EPISODES, time.asctime())]
+        for mob_type, mob_list in mobs.items():
+            if mob_type != 'Food':
+                for mob in mob_list:
+                    lines.append('{} {:>8}: {:<9} ({})'.format(mob.__class__, mob.serial, round(rewards.current(mob), 3), mob.alive))
+        CONSOLE.write('\n'.join(lines) + '\n\n' + '='*60 + '\n\n')
+    rewards.end_episode(episode=episode, frames=frames, epsilon=epsilon)
+    if VERBOSITY == 'progress':
+        means = {mob_type: np.mean([rewards.trend(mob).mean() for mob in mob_list]) for mob_type, mob_list in mobs.items() if mob_type != 'Food' and mob_list}
+        PROGRESS.update(episode=episode, frames=frames, epsilon=epsilon, means=means)
+    if TIMER:
+        TIMER.lap('cleanup')
+        TIMER.flush(episode=episode)
+
+
+@contextlib.contextmanager
+def profiled(episode=0, show_this=False):
+    # cProfile one episode into PROFILES, for shown episodes only
+    if not (PROFILE and show_this):
+        yield
         return
-    for mob_type, mob_list in mobs.items():
-        for mob in mob_list:
-            if mob.alive:
-                mob.display(gameDisplay)
-
 
-def episode_cleanup(episode, mobs, rewards):
-    print('Episode {}/{} completed at {}'.format(episode+1, EPISODES, time.asctime()))
-    for mob_type, mob_list in mobs.items():
-        if mob_type != 'Food':
-            for mob in mob_list:
-                print('{} {:>8}: {:<9} ({})'.format(mob.__class__, mob.serial, round(rewards[mob][episode], 3), mob.alive))
-    print('\n' + '='*60 + '\n')
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.join(RES, PROFILES), exist_ok=True)
+        filename = os.path.join(RES, PROFILES, 'episode-{}.prof'.format(episode))
+        print('Saving episode profile as {}'.format(filename))
+        profiler.dump_stats(filename)
+
+
+def unique_q_tables(mobs=None, which=('Prey', 'Predator')):
+    # (mob type, name, table) once per table: named for its mob, or 'shared' when a species shares one
+    tables = []
+    for mob_type in which:
+        q_tables = [mob.q_table for mob in mobs[mob_type]]
+        for mob in mobs[mob_type]:
+            if any(q_table is mob.q_table for t, name, q_table in tables):
+                continue
+            shared = sum(q_table is mob.q_table for q_table in q_tables) > 1
+            tables.append((mob_type, 'shared' if shared else mob.serial, mob.q_table))
+    return tables
 
 
 def save_q_tables(save_enabled, mobs=None, which=('Prey', 'Predator')):
     if save_enabled:
-        for mob_type in which:
-            for mob in mobs[mob_type]:
-                mob.q_table.save(os.path.join(RES, TABLES), mob_type, mob.serial)
+        for mob_type, name, q_table in unique_q_tables(mobs=mobs, which=which):
+            q_table.save(os.path.join(RES, TABLES), mob_type, name, info=mobs[mob_type][0].q_info())
     else:
         print('Q table saving disabled')
 
 
 def plot_q_tables(mobs=None, valued_customer=None):
     mobs_to_plot = [valued_customer] if valued_customer else ('Prey', 'Predator')
+    os.makedirs(os.path.join(RES, PLOTS), exist_ok=True)
     
-    for mob_type in mobs_to_plot:  # 'Food' has no q_table
-        for mob in mobs[mob_type]:
-            mob.q_table.plot_q(os.path.join(RES, PLOTS, '{}_Q.png'.format(mob.serial)))  # moving out of game loop removed seg fault
+    for mob_type, name, q_table in unique_q_tables(mobs=mobs, which=mobs_to_plot):  # 'Food' has no q_table
+        name = name if name != 'shared' else '{}-shared'.format(mob_type)
+        q_table.plot_q(os.path.join(RES, PLOTS, '{}_Q.png'.format(name)))  # moving out of game loop removed seg fault
 
 
-def plot_rewards(mobs=None, rewards=None, valued_customer=None):
+def plot_rewards(mobs=None, rewards=None, valued_customer=None, quiet=False):
     mobs_to_plot = [valued_customer] if valued_customer else ('Prey', 'Predator')
+    os.makedirs(os.path.join(RES, PLOTS), exist_ok=True)
     
     for mob_type, mob_list in mobs.items():
         if mob_type in mobs_to_plot:
             for mob in mob_list:
-                plt.plot(rewards[mob], label='{}:{}'.format(mob_type, mob.serial))
-                moving_avg = np.convolve(rewards[mob], np.ones((M_AVG,))/M_AVG, mode='valid')
-                plt.plot(moving_avg, label='moving average, {}'.format(M_AVG))
-                plt.xlabel('Episode')
-                plt.ylabel('Reward')
-                plt.legend()
+                raw, moving_avg = rewards.trend(mob).series()  # decimated, so plotting cost doesn't grow with the run
+                fig = Figure()  # not pyplot, so redrawing mid-run leaves the pygame window alone
+                ax = fig.subplots()
+                ax.plot(*raw, label='{}:{}'.format(mob_type, mob.serial))
+                ax.plot(*moving_avg, label='moving average, {}'.format(M_AVG))
+                ax.set_xlabel('Episode')
+                ax.set_ylabel('Reward')
+                ax.legend()
                 fig_name = os.path.join(RES, PLOTS, '{}-{}.png'.format(mob.__class__, mob.serial))
-                print('Saving episode rewards plot as {}'.format(fig_name))
-                plt.savefig(fig_name)
-                plt.close()
+                if not quiet:
+                    print('Saving episode rewards plot as {}'.format(fig_name))
+                fig.savefig(fig_name)
+
+
+def refresh_plots(episode=0, mobs=None, rewards=None, valued_customer=None):
+    # redraw the reward plots from the running summaries every PLOT_EVERY episodes
+    if PLOT_EVERY and (episode + 1) % PLOT_EVERY == 0:
+        plot_rewards(mobs=mobs, rewards=rewards, valued_customer=valued_customer, quiet=True)
+
+
+def share_q_tables(mobs=None):
+    # move every Q table into shared memory, so worker processes update the same values
+    shared = {}
+    seen = []
+    for mob_type, mob_list in mobs.items():
+        for num, mob in enumerate(mob_list):
+            if mob.q_table is None or any(mob.q_table is q_table for q_table in seen):
+                continue  # a species-wide table only goes in once
+            seen.append(mob.q_table)
+            values = mob.q_table.values
+            shm = shared_memory.SharedMemory(create=True, size=values.nbytes)
+            mob.q_table.values = np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)
+            mob.q_table.values[:] = values
+            shared[(mob_type, num)] = shm
+    return shared
+
+
+def attach_q_tables(mobs=None, names=None):
+    # point this process's mobs at the Q tables shared by share_q_tables()
+    shared = {}
+    for (mob_type, num), name in names.items():
+        q_table = mobs[mob_type][num].q_table
+        shm = shared_memory.SharedMemory(name=name)
+        q_table.values = np.ndarray(q_table.values.shape, dtype=q_table.values.dtype, buffer=shm.buf)
+        shared[(mob_type, num)] = shm
+    return shared
+
+
+def release_q_tables(mobs=None, shared=None, unlink=False):
+    # copy the tables back into private memory before the shared blocks go away
+    for (mob_type, num), shm in shared.items():
+        q_table = mobs[mob_type][num].q_table
+        q_table.values = q_table.values.copy()
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+def reward_file(mode='run'):
+    return os.path.join(RES, REWARDS, '{}.rewards'.format(mode)) if REWARD_LOG else None
+
+
+def checkpoint_file(mode='run'):
+    return os.path.join(RES, CHECKPOINTS, '{}.ckpt'.format(mode))
+
+
+def start_checkpoints(mode='run'):
+    if not (CHECKPOINT_EVERY or CHECKPOINT_SECS):
+        return None
+    return Checkpointer(filename=checkpoint_file(mode), every=CHECKPOINT_EVERY, seconds=CHECKPOINT_SECS)
+
+
+def checkpoint(checkpointer=None, mode='run', episode=0, epsilon=0, mobs=None, rewards=None, final=False):
+    # after finishing episode: snapshot everything needed to carry on from episode + 1, then write it in the background
+    if not checkpointer or not (final or checkpointer.due(episode)):
+        return
+
+    q_tables = {}
+    for mob_type, mob_list in mobs.items():
+        for num, mob in enumerate(mob_list):
+            if mob.q_table is not None and not any(mob.q_table is q for q in q_tables.values()):
+                q_tables[(mob_type, num)] = mob.q_table
+    state = {'mode': mode,
+             'episode': episode + 1,
+             'epsilon': epsilon,
+             'rng': Mob.rng.state(),
+             'serials': {(mob_type, num): mob.serial for mob_type, mob_list in mobs.items() for num, mob in enumerate(mob_list)},
+             'q_tables': {key: np.array(q_table.values) for key, q_table in q_tables.items()},
+             'replays': {key: q_table.replay.snapshot() for key, q_table in q_tables.items() if q_table.replay is not None},
+             'rewards': rewards.snapshot(),
+            }
+    checkpointer.submit(state)
+    if final:
+        checkpointer.close()
+        if VERBOSITY != 'quiet':
+            CONSOLE.write('Checkpoint after episode {} saved as {}\n'.format(episode + 1, checkpointer.filename))
+
+
+def resumable(mode='run'):
+    # whether resume will restore a checkpoint, so the reward log is continued rather than started over
+    return RESUME and os.path.exists(checkpoint_file(mode))
+
+
+def resume(mode='run', mobs=None, rewards=None, epsilon=0):
+    # restore a checkpoint onto freshly built mobs; returns the episode to start from and its epsilon
+    if not RESUME:
+        return 0, epsilon
+    filename = checkpoint_file(mode)
+    if not resumable(mode):
+        print('No checkpoint at {}, starting from episode 1'.format(filename))
+        return 0, epsilon
+
+    state = load_checkpoint(filename)
+    counts = {mob_type: len(mob_list) for mob_type, mob_list in mobs.items()}
+    saved = {mob_type: 0 for mob_type in counts}
+    for mob_type, num in state['serials']:
+        saved[mob_type] = max(saved.get(mob_type, 0), num + 1)
+    if saved != counts:
+        raise ValueError('Checkpoint {} has mobs {}, this run has {}'.format(filename, saved, counts))
+
+    for (mob_type, num), serial in state['serials'].items():
+        mobs[mob_type][num].serial = serial
+    rewards.restore(state['rewards'])
+    for (mob_type, num), values in state['q_tables'].items():
+        mobs[mob_type][num].q_table.values = values  # a shared table is restored once, for all its mobs
+    for (mob_type, num), replay in state.get('replays', {}).items():
+        if mobs[mob_type][num].q_table.replay is not None:
+            mobs[mob_type][num].q_table.replay.restore(replay)
+    if 'rng' in state:  # checkpoints from before WorldRNG resume on a fresh stream
+        Mob.rng.restore(state['rng'])
+
+    print('Resuming {} from episode {} of {}'.format(filename, state['episode'] + 1, EPISODES))
+    return state['episode'], state['epsilon']
+
+
+def seed_rng(seed=None):
+    # a fresh WorldRNG for this process's world; None seeds it from the OS
+    Mob.rng = WorldRNG(seed)
 
 
 def exit_sim():
+    if HEADLESS:
+        if LOG: LOG.write('\nExiting normally (headless)!\n')
+        return
+
+    if RENDERER:
+        RENDERER.close()  # let it finish drawing what was shown
     fade_out = 1
-    pygame.mixer.music.fadeout(fade_out * 1000)
-    LOG.write('\nExiting normally!\n')
-    #LOG.close()   # FIXME when you remove traceback
+    if pygame.mixer.get_init():  # no audio device on some boxes
+        pygame.mixer.music.fadeout(fade_out * 1000)
+    if LOG: LOG.write('\nExiting normally!\n')
     time.sleep(fade_out)
     pygame.display.quit()
     pygame.quit()
@@ -211,77 +523,144 @@ def train(mode='prey', food=0, prey=(0, False), pred=0):
     # set the sceen size
     WIDTH = int(Prey.sight * 1.5) if pred == 0 else int(Predator.sight * 1.5)
     HEIGHT = WIDTH
-    pygame.display.set_mode((WIDTH, HEIGHT))
-    mobs, epsilon, rewards = sim_init(food=food, prey=prey[0], pred=pred)
-
-    for episode in range(EPISODES):
+    if WORKERS > 1:
+        return train_parallel(mode=mode, food=food, prey=prey, pred=pred)
+    if not HEADLESS:
+        render_init()
+    mobs, world, epsilon, rewards = sim_init(food=food, prey=prey[0], pred=pred, log=reward_file(mode), append=resumable(mode))
+    first, epsilon = resume(mode=mode, mobs=mobs, rewards=rewards, epsilon=epsilon)
+    start_recording(mode)  # before the checkpoint thread, as it may fork
+    checkpointer = start_checkpoints(mode)
+
+    frames = 0
+    start = time.perf_counter()
+    for episode in range(first, EPISODES):
         show_this = True if episode % SHOW == 0 else False
-        end_ep = False
-        
-        # reset all the mobs for this episode
-        reset_mobs(mobs=mobs, center=valued_customer)
-        
-        # run the episode
-        for k in range(FRAMES):
-            gameDisplay.fill(BLACK)
-            
-            # update mobs
-            end_ep = mob_update(mode=mode, mobs=mobs, epsilon=epsilon, rewards=rewards, episode=episode, allow_prey_movement=allow_prey_movement)
-
-            display_mobs(show_this=show_this, mobs=mobs)
-            
-            # complete the render and wait to cycle
-            display_stats(episode, k+1, mobs)
-            pygame.display.update()
-            if show_this:
-                clock.tick(FPS)
-            else:
-                clock.tick(10**10)
-
-            if end_ep:
-                if show_this:
-                    time.sleep(1)  # pause at the end state
-                break
-
-        # clean up the episode
-        episode_cleanup(episode, mobs, rewards)
+        with profiled(episode=episode, show_this=show_this):
+            frames += play_episode(mode=mode, mobs=mobs, world=world, epsilon=epsilon, rewards=rewards, episode=episode, allow_prey_movement=allow_prey_movement, show_this=show_this, center=valued_customer)
         epsilon *= DECAY_RATE
+        checkpoint(checkpointer, mode=mode, episode=episode, epsilon=epsilon, mobs=mobs, rewards=rewards, final=episode == EPISODES - 1)
+        refresh_plots(episode=episode, mobs=mobs, rewards=rewards, valued_customer=valued_customer)
 
+    rewards.flush()
+    CONSOLE.flush()
+    report_speed(frames, start, episodes=EPISODES - first)
+    stop_recording()
     save_q_tables(SAVE_Q, mobs=mobs, which=[valued_customer])
 
     return mobs, rewards, valued_customer
 
 
+def play_episode(mode='prey', mobs=None, world=None, epsilon=0, rewards=None, episode=0, allow_prey_movement=True, show_this=False, center=None, stop=True):
+    # one episode for train, its workers and run: center is the mob type started mid-screen, and stop
+    # ends the episode when a mob dies (run plays every frame); shown episodes are rendered and every
+    # RECORD-th is recorded
+    end_ep = False
+    
+    # reset all the mobs for this episode
+    render = show_this and not HEADLESS
+    record = RECORDER is not None and episode % RECORD == 0
+    Mob.record_moves = render or record  # move history is only ever drawn
+    reset_mobs(mobs=mobs, center=center)
+    if world:
+        world.pull()
+    
+    # run the episode
+    frames = 0
+    for k in range(FRAMES):
+        # update mobs
+        end_ep = mob_update(mode=mode, mobs=mobs, epsilon=epsilon, rewards=rewards, episode=episode, allow_prey_movement=allow_prey_movement, world=world) and stop
+        frames += 1
+        world_sync(world=world, moves=render or record)
+
+        if render or record:
+            render_frame(episode=episode, frame=k+1, mobs=mobs, last=end_ep or k == FRAMES - 1, pause=end_ep, show=render, record=record)  # pause at the end state
+
+        if end_ep:
+            break
+
+    # clean up the episode
+    world_sync(world=world, rewards=rewards, episode=episode, end=True)
+    end_learning(mobs)
+    episode_cleanup(episode, mobs, rewards, frames=frames, epsilon=epsilon)
+
+    return frames
+
+
+def train_parallel(mode='prey', food=0, prey=(0, False), pred=0):
+    # Hogwild: WORKERS processes run interleaved episodes, updating one shared Q table without locks
+    valued_customer = 'Prey' if prey[1] else 'Predator'
+    mobs, world, epsilon, rewards = sim_init(food=food, prey=prey[0], pred=pred, log=reward_file(mode))
+    shared = share_q_tables(mobs)
+    settings = {name: globals()[name] for name in WORKER_SETTINGS}
+    names = {key: shm.name for key, shm in shared.items()}
+    jobs = [(worker, settings, mode, food, prey, pred, names) for worker in range(WORKERS)]
+
+    CONSOLE.flush()  # its thread sits idle, holding no locks, while the workers fork
+    start = time.perf_counter()
+    try:
+        with multiprocessing.Pool(WORKERS) as pool:
+            results = pool.starmap(train_worker, jobs)
+    finally:
+        release_q_tables(mobs=mobs, shared=shared, unlink=True)
+
+    # worker w ran episodes w, w + WORKERS, ...; log them back in episode order
+    records = np.sort(np.concatenate(results), order='episode')
+    for record in records:
+        rewards.append(episode=record['episode'], frames=record['frames'], epsilon=record['epsilon'], totals=[record[name] for name in rewards.names])
+    rewards.flush()
+    frames = int(records['frames'].sum())
+
+    report_speed(frames, start, episodes=EPISODES)
+    save_q_tables(SAVE_Q, mobs=mobs, which=[valued_customer])
+
+    return mobs, rewards, valued_customer
+
+
+def train_worker(worker=0, settings=None, mode='prey', food=0, prey=(0, False), pred=0, names=None):
+    globals().update(settings)
+    globals()['TIMER'] = None  # per-phase timing covers serial runs only
+    Predator.trace = None  # and so does the predator trace
+    seed_rng(None if SEED is None else SEED + worker)  # forked workers would otherwise share one RNG state
+
+    mobs, world, epsilon, rewards = sim_init(food=food, prey=prey[0], pred=pred)  # rewards kept in memory, logged by the parent
+    shared = attach_q_tables(mobs=mobs, names=names)
+    start_recording(mode)
+
+    try:
+        for episode in range(worker, EPISODES, WORKERS):
+            epsilon = EPSILON * DECAY_RATE ** episode  # where the serial schedule would be by this episode
+            play_episode(mode=mode, mobs=mobs, world=world, epsilon=epsilon, rewards=rewards, episode=episode, allow_prey_movement=prey[1], center='Prey' if prey[1] else 'Predator')
+    finally:
+        release_q_tables(mobs=mobs, shared=shared)
+        stop_recording()
+        CONSOLE.flush()
+
+    return rewards.records()
+
+
 def run(mode='run', food=0, prey=0, pred=0):
-    mobs, epsilon, rewards = sim_init(food=food, prey=prey, pred=pred)
+    if not HEADLESS:
+        render_init()
+    mobs, world, epsilon, rewards = sim_init(food=food, prey=prey, pred=pred, log=reward_file(mode), append=resumable(mode))
+    first, epsilon = resume(mode=mode, mobs=mobs, rewards=rewards, epsilon=epsilon)
+    start_recording(mode)  # before the checkpoint thread, as it may fork
+    checkpointer = start_checkpoints(mode)
     
-    for episode in range(EPISODES):
+    frames = 0
+    start = time.perf_counter()
+    for episode in range(first, EPISODES):
         show_this = True if episode % SHOW == 0 else False
-        
-        # reset all the mobs for this episode
-        reset_mobs(mobs=mobs)
-        
-        # run the episode
-        for k in range(FRAMES):
-            gameDisplay.fill(BLACK)
-            
-            # update all mobs
-            mob_update(mode=mode, mobs=mobs, epsilon=epsilon, rewards=rewards, episode=episode)
-            
-            display_mobs(show_this=show_this, mobs=mobs)
-            
-            # complete the render and wait to cycle
-            display_stats(episode, k+1, mobs)
-            pygame.display.update()
-            if show_this:
-                clock.tick(FPS)
-            else:
-                clock.tick(10**10)
-
-        # clean up the episode
-        episode_cleanup(episode, mobs, rewards)
+        with profiled(episode=episode, show_this=show_this):
+            frames += play_episode(mode=mode, mobs=mobs, world=world, epsilon=epsilon, rewards=rewards, episode=episode, show_this=show_this, stop=False)
         epsilon *= DECAY_RATE
+        checkpoint(checkpointer, mode=mode, episode=episode, epsilon=epsilon, mobs=mobs, rewards=rewards, final=episode == EPISODES - 1)
+        refresh_plots(episode=episode, mobs=mobs, rewards=rewards)
 
+    rewards.flush()
+    CONSOLE.flush()
+    report_speed(frames, start, episodes=EPISODES - first)
+    stop_recording()
     save_q_tables(SAVE_Q, mobs=mobs)
 
     return mobs, rewards
@@ -291,6 +670,29 @@ def main():
     parser = argparse.ArgumentParser(description='''Predator/Prey AI Trainer and Visualizer''')
 
     parser.add_argument('-m', '--mode', help='training/execution mode for AI', default=MODE)
+    parser.add_argument('--headless', help='simulate without any display or frame limiting', action='store_true')
+    parser.add_argument('--engine', help='per-mob objects or batched arrays world engine (arrays pays off from a few hundred mobs)', choices=('objects', 'arrays'), default=ENGINE)
+    parser.add_argument('--spatial', help='use a grid index for neighbour queries', action='store_true')
+    parser.add_argument('--workers', help='training processes sharing one Q table (implies --headless)', type=int, default=WORKERS)
+    parser.add_argument('--shared-q', help='one Q table per species, shared by all its mobs', dest='shared_q', action='store_true')
+    parser.add_argument('--seed', help='random seed', type=int, default=SEED)
+    parser.add_argument('--checkpoint-every', help='episodes between checkpoints', dest='checkpoint_every', type=int, default=CHECKPOINT_EVERY)
+    parser.add_argument('--checkpoint-secs', help='seconds between checkpoints', dest='checkpoint_secs', type=float, default=CHECKPOINT_SECS)
+    parser.add_argument('--resume', help='continue from the last checkpoint of this mode', action='store_true')
+    parser.add_argument('--prey-learner', help='prey Q update', choices=('one-step', 'n-step', 'lambda'), default=PREY_LEARNER)
+    parser.add_argument('--pred-learner', help='predator Q update', choices=('one-step', 'n-step', 'lambda'), default=PRED_LEARNER)
+    parser.add_argument('--n-step', help='rewards per n-step return', type=int, default=N_STEP)
+    parser.add_argument('--trace-decay', help='lambda for Q(lambda)', type=float, default=TRACE_DECAY)
+    parser.add_argument('--replay', help='learn from batches of replayed transitions instead of after every action', action='store_true')
+    parser.add_argument('--replay-size', help='transitions kept per Q table', type=int, default=REPLAY_SIZE)
+    parser.add_argument('--replay-batch', help='transitions per batched update', type=int, default=REPLAY_BATCH)
+    parser.add_argument('--replay-every', help='transitions recorded between batched updates', type=int, default=REPLAY_EVERY)
+    parser.add_argument('--verbosity', help='per-episode output: none, a summary every --progress-secs, or every episode', choices=('quiet', 'progress', 'episodes'), default=VERBOSITY)
+    parser.add_argument('--progress-secs', help='seconds between progress summaries', type=float, default=PROGRESS_SECS)
+    parser.add_argument('--trace', help='record every predator action to resources/pred.trace (serial runs)', action='store_true')
+    parser.add_argument('--no-reward-log', help='keep episode rewards in memory instead of resources/rewards', dest='reward_log', action='store_false')
+    parser.add_argument('--timing', help='write per-episode phase timings to this .csv (or JSON lines) file', default=None)
+    parser.add_argument('--profile', help='cProfile shown episodes into resources/profiles', action='store_true')
 
     # mob selection
     parser.add_argument('--pred', help='number of predator mobs', default=0)
@@ -306,10 +708,15 @@ def main():
     parser.add_argument('--no-plot', help='don\'t plot episode rewards', dest='plot_rew', action='store_false')
     parser.set_defaults(plot_rew=True)
     parser.add_argument('--mvg-avg', help='moving average history for plot', default=M_AVG)
+    parser.add_argument('--plot-every', help='redraw the reward plots every this many episodes', type=int, default=PLOT_EVERY)
+    parser.add_argument('--plot-points', help='most points per reward plot before decimating', type=int, default=PLOT_POINTS)
 
     # training variables
     parser.add_argument('--episodes', help='number of training episodes', default=EPISODES)
     parser.add_argument('--show', help='regularity to visualize environment', default=SHOW)
+    parser.add_argument('--record', help='record every this many episodes to resources/recordings, offscreen (0 for never)', type=int, default=RECORD)
+    parser.add_argument('--record-format', help='png: a file per frame, raw: an RGB stream per episode (see its .json)', choices=FrameWriter.FORMATS, default=RECORD_FORMAT)
+    parser.add_argument('--render-every', help='draw every this many frames of a shown episode (fast-forward)', type=int, default=RENDER_EVERY)
     parser.add_argument('--frames', help='steps per training episode', default=FRAMES)
     parser.add_argument('--epsilon', help='random decision threshold', default=EPSILON)
     parser.add_argument('--decay', help='random decision threshold decay rate', default=DECAY_RATE)
@@ -322,25 +729,57 @@ def main():
     globals()['PREY_TABLE'] = False if not args.q_prey else os.path.join(RES, TABLES, args.q_prey)
     globals()['PRED_TABLE'] = False if not args.q_pred else os.path.join(RES, TABLES, args.q_pred)
     globals()['SAVE_Q'] = args.save_q
+    globals()['WORKERS'] = max(args.workers, 1)
+    if WORKERS > 1 and (args.resume or args.checkpoint_every or args.checkpoint_secs):
+        parser.error('--resume and --checkpoint-* cover serial runs only, not --workers > 1')
+    globals()['HEADLESS'] = args.headless or WORKERS > 1
+    globals()['SHARED_Q'] = args.shared_q
+    globals()['SEED'] = args.seed
+    globals()['TIMER'] = PhaseTimer(filename=args.timing) if args.timing else None
+    globals()['PROFILE'] = args.profile
+    globals()['CHECKPOINT_EVERY'] = args.checkpoint_every
+    globals()['CHECKPOINT_SECS'] = args.checkpoint_secs
+    globals()['RESUME'] = args.resume
+    globals()['REWARD_LOG'] = args.reward_log
+    if args.replay and (args.prey_learner, args.pred_learner) != ('one-step', 'one-step'):
+        parser.error('--replay learns from one-step transitions, so it needs --prey-learner and --pred-learner one-step')
+    globals()['PREY_LEARNER'] = args.prey_learner
+    globals()['PRED_LEARNER'] = args.pred_learner
+    globals()['N_STEP'] = max(args.n_step, 1)
+    globals()['TRACE_DECAY'] = args.trace_decay
+    globals()['REPLAY'] = args.replay
+    globals()['REPLAY_SIZE'] = args.replay_size
+    globals()['REPLAY_BATCH'] = args.replay_batch
+    globals()['REPLAY_EVERY'] = max(args.replay_every, 1)
+    globals()['VERBOSITY'] = args.verbosity
+    globals()['PROGRESS_SECS'] = args.progress_secs
+    if args.trace:
+        Predator.trace = TraceBuffer(os.path.join(RES, TRACE))
+    globals()['ENGINE'] = args.engine
+    globals()['SPATIAL'] = args.spatial
 
     globals()['EPISODES'] = int(args.episodes)
     globals()['SHOW'] = int(args.show)
+    globals()['RENDER_EVERY'] = max(args.render_every, 1)
+    globals()['RECORD'] = max(args.record, 0)
+    globals()['RECORD_FORMAT'] = args.record_format
     globals()['FRAMES'] = int(args.frames)
     globals()['EPSILON'] = float(args.epsilon)
     globals()['DECAY_RATE'] = float(args.decay)
     
     globals()['M_AVG'] = int(args.mvg_avg)
+    globals()['PLOT_EVERY'] = args.plot_every if args.plot_rew else 0
+    globals()['PLOT_POINTS'] = args.plot_points
+    seed_rng(SEED)
 
-    if args.mode == 'pred':
-        mobs, rewards, valued_customer = train(mode=args.mode, food=0, prey=(1, False), pred=1)  # train the predator Q table
-    elif args.mode == 'prey':
-        mobs, rewards, valued_customer = train(mode=args.mode, food=1, prey=(1, True), pred=0)  # train the prey Q table (target)
-    elif args.mode == 'evade':
-        mobs, rewards, valued_customer = train(mode=args.mode, food=0, prey=(1, True), pred=1)  # train the prey Q table (flee)
+    if args.mode in SCENARIOS:
+        mobs, rewards, valued_customer = train(mode=args.mode, **SCENARIOS[args.mode])
     else:
         mobs, rewards = run(food=int(args.food), prey=int(args.prey), pred=int(args.pred))
 
     exit_sim()
+    if Predator.trace is not None:
+        Predator.trace.close()
 
     plot_q_tables(mobs=mobs, valued_customer=valued_customer)
     if args.plot_rew:
@@ -349,6 +788,7 @@ def main():
 
 if __name__ == '__main__':
     import traceback
+    LOG = LogWriter(os.path.join(RES, 'game.log'))
     tb = 'no error'
     try:
         main()  # FIXME just run this
@@ -359,4 +799,5 @@ if __name__ == '__main__':
         LOG.write('{}\n'.format(tb))
         LOG.write('End!')
         LOG.close()
+        CONSOLE.close()
     print('Exiting main() with {}'.format(tb))
@@ -0,0 +1,69 @@
+import os
+import pickle
+import threading
+import time
+
+
+class Checkpointer():
+    # writes training snapshots on a background thread, so the sim loop never waits on disk
+    # only the newest snapshot matters: one still waiting when a newer one arrives is dropped
+
+    def __init__(self, filename=None, every=0, seconds=0):
+        self.filename = filename
+        self.every = every  # episodes between checkpoints, 0 for never
+        self.seconds = seconds  # seconds between checkpoints, 0 for never
+        self.last = time.monotonic()
+        self.written = 0
+
+        self.pending = None
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.closing = False
+        self.thread = threading.Thread(target=self.writer, name='checkpoint-writer', daemon=True)
+        self.thread.start()
+
+    def due(self, episode=0):
+        # after finishing episode (0-based)
+        if self.every and (episode + 1) % self.every == 0:
+            return True
+        return bool(self.seconds) and time.monotonic() - self.last >= self.seconds
+
+    def submit(self, state=None):
+        # state must already be a copy: the sim keeps running while it is written
+        self.last = time.monotonic()
+        with self.lock:
+            self.pending = state
+        self.wake.set()
+
+    def writer(self):
+        while True:
+            self.wake.wait()
+            with self.lock:
+                state, self.pending = self.pending, None
+                self.wake.clear()
+                closing = self.closing
+            if state is not None:
+                self.write(state)
+            if closing:
+                return
+
+    def write(self, state=None):
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        partial = '{}.tmp'.format(self.filename)
+        with open(partial, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(partial, self.filename)  # a crash mid-write leaves the previous checkpoint intact
+        self.written += 1
+
+    def close(self):
+        # wait for anything pending to reach disk
+        with self.lock:
+            self.closing = True
+        self.wake.set()
+        self.thread.join()
+
+
+def load_checkpoint(filename=None):
+    # checkpoints are pickles: only resume from files you wrote
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
@@ -1,15 +1,15 @@
-import random as rnd
+from resources.rng import WorldRNG
 
 black = (0, 0, 0)
 white = (255, 255, 255)
 
 
-def random_range(red, green, blue):
-    r = rnd.randint(red[0], red[1])
-    g = rnd.randint(green[0], green[1])
-    b = rnd.randint(blue[0], blue[1])
+def random_range(red, green, blue, rng=None):
+    # rng: a WorldRNG, for colours that follow the run's seed
+    rng = rng or WorldRNG()
+    r, g, b = rng.integers((red[0], green[0], blue[0]), (red[1], green[1], blue[1]), size=3)
     
     return (r, g, b)
 
-def random():
-    return random_range((0, 255), (0, 255), (0, 255))
\ No newline at end of file
+def random(rng=None):
+    return random_range((0, 255), (0, 255), (0, 255), rng=rng)
\ No newline at end of file
@@ -0,0 +1,134 @@
+import math
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# VectorWorld's branchy per-agent pieces of a frame, over (K, rows) state arrays, in two interchangeable forms:
+# NumPy ops across the K worlds, and plain loops over them that numba compiles when it is installed
+# both do the same float operations in the same order, so their results are bit-identical
+
+
+def move_numpy(x, y, row, steps, choice, acting, width, height):
+    # Mob.move: the choice's precomputed step, stopped at the walls; x and y are updated in place
+    mx, my = steps[choice].T
+    mx = np.where(acting, mx, 0)
+    my = np.where(acting, my, 0)
+    px = x[:, row]
+    py = y[:, row]
+
+    mx = np.where(px + mx < 0, 0 - px, mx)  # left bound
+    mx = np.where(width < px + mx, width - px, mx)  # right bound
+    my = np.where(py + my < 0, 0 - py, my)  # upper bound
+    my = np.where(height < py + my, height - py, my)  # lower bound
+    x[:, row] = px + mx
+    y[:, row] = py + my
+
+    return mx, my
+
+
+def eat_numpy(x, y, health, alive, target, health_init, row, start, stop, acting, reward):
+    # the eating half of Mob.check for rows start:stop, in order; adds meals to reward in place
+    k = x.shape[0]
+    worlds = np.arange(k)
+    cols = np.arange(stop - start)
+    last = np.full(k, -1, dtype=np.int64)
+    while stop > start:
+        # first thing each mob can reach at its current size, past the last one eaten
+        ds = ((x[:, start:stop] - x[:, [row]])**2 + (y[:, start:stop] - y[:, [row]])**2) ** 0.5
+        reach = health[:, start:stop] ** 0.5 + health[:, [row]] ** 0.5
+        hits = acting[:, None] & alive[:, start:stop] & (ds < reach) & (cols > last[:, None])
+        found = hits.any(axis=1)
+        if not found.any():
+            break
+        eaten = start + hits.argmax(axis=1)
+        w = worlds[found]
+        other = eaten[found]
+
+        # eat the prey/food, be rewarded
+        health[w, row] += health[w, other]
+        reward[w] += health_init[other]
+        target[w, row] = -1
+        health[w, other] = 0
+        alive[w, other] = False
+        last = np.where(found, eaten - start, stop - start)
+
+
+def flee_numpy(x, y, health, alive, health_init, row, start, stop, reward):
+    # the penalty half of Mob.check: one mob's health_init for everything in rows start:stop touching it
+    ds = ((x[:, start:stop] - x[:, [row]])**2 + (y[:, start:stop] - y[:, [row]])**2) ** 0.5
+    reach = health[:, start:stop] ** 0.5 + health[:, [row]] ** 0.5
+    touching = np.count_nonzero(alive[:, start:stop] & (ds < reach), axis=1)
+    reward -= touching * health_init[row]  # pentalty for being eaten
+
+
+def move_loops(x, y, row, steps, choice, acting, width, height):
+    k = x.shape[0]
+    mx = np.zeros(k)
+    my = np.zeros(k)
+    for w in range(k):
+        if acting[w]:
+            mx[w] = steps[choice[w], 0]
+            my[w] = steps[choice[w], 1]
+        px = x[w, row]
+        py = y[w, row]
+        if px + mx[w] < 0:
+            mx[w] = 0 - px
+        if width < px + mx[w]:
+            mx[w] = width - px
+        if py + my[w] < 0:
+            my[w] = 0 - py
+        if height < py + my[w]:
+            my[w] = height - py
+        x[w, row] = px + mx[w]
+        y[w, row] = py + my[w]
+    return mx, my
+
+
+def eat_loops(x, y, health, alive, target, health_init, row, start, stop, acting, reward):
+    # one forward scan per world: a meal only grows the eater, so nothing already passed comes back into reach
+    for w in range(x.shape[0]):
+        if not acting[w]:
+            continue
+        size = math.sqrt(health[w, row])
+        for other in range(start, stop):
+            if not alive[w, other]:
+                continue
+            dx = x[w, other] - x[w, row]
+            dy = y[w, other] - y[w, row]
+            if math.sqrt(dx * dx + dy * dy) < math.sqrt(health[w, other]) + size:
+                health[w, row] += health[w, other]
+                reward[w] += health_init[other]
+                target[w, row] = -1
+                health[w, other] = 0
+                alive[w, other] = False
+                size = math.sqrt(health[w, row])
+
+
+def flee_loops(x, y, health, alive, health_init, row, start, stop, reward):
+    for w in range(x.shape[0]):
+        touching = 0
+        size = math.sqrt(health[w, row])
+        for other in range(start, stop):
+            dx = x[w, other] - x[w, row]
+            dy = y[w, other] - y[w, row]
+            if alive[w, other] and math.sqrt(dx * dx + dy * dy) < math.sqrt(health[w, other]) + size:
+                touching += 1
+        reward[w] -= touching * health_init[row]
+
+
+BACKENDS = {'numpy': (move_numpy, eat_numpy, flee_numpy)}
+if numba is not None:
+    BACKENDS['numba'] = tuple(numba.njit(cache=True)(kernel) for kernel in (move_loops, eat_loops, flee_loops))
+
+
+def kernels(backend='auto'):
+    # (move, eat, flee) for a backend; auto is numba when it is installed
+    if backend == 'auto':
+        backend = 'numba' if 'numba' in BACKENDS else 'numpy'
+    if backend not in BACKENDS:
+        raise ValueError('{} kernels are not available (have {})'.format(backend, ', '.join(BACKENDS)))
+    return BACKENDS[backend]
@@ -0,0 +1,113 @@
+import os
+import queue
+import sys
+import threading
+import time
+import numpy as np
+
+
+class LogWriter():
+    # text (or bytes) handed to a background thread, so the sim loop never waits on the terminal or disk
+    # the thread starts on first write, and again in a forked child, which inherits the object but not the thread
+
+    def __init__(self, filename=None, binary=False):
+        self.filename = filename  # None for whatever sys.stdout is when the text is written
+        self.binary = binary
+        self.pid = None
+
+    def start(self):
+        self.pid = os.getpid()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.writer, name='log-writer', daemon=True)
+        self.thread.start()
+
+    def write(self, text=''):
+        if self.pid != os.getpid():
+            self.start()
+        self.queue.put(text)
+
+    def writer(self):
+        f = open(self.filename, 'wb' if self.binary else 'w') if self.filename else None
+        while True:
+            items = [self.queue.get()]
+            while not self.queue.empty():  # everything already waiting goes out with one flush
+                items.append(self.queue.get())
+            out = f or sys.stdout
+            for item in items:
+                if item is not None:
+                    out.write(item)
+            out.flush()
+            for item in items:
+                self.queue.task_done()
+            if None in items:
+                if f:
+                    f.close()
+                return
+
+    def flush(self):
+        # wait until everything written so far is out
+        if self.pid == os.getpid():
+            self.queue.join()
+
+    def close(self):
+        if self.pid == os.getpid():
+            self.queue.put(None)
+            self.thread.join()
+        self.pid = None
+
+
+class Progress():
+    # one summary line per `interval` seconds instead of one block per episode
+
+    def __init__(self, writer=None, interval=5, episodes=0):
+        self.writer = writer
+        self.interval = interval
+        self.episodes = episodes
+        self.last = time.perf_counter()
+        self.done = 0  # episodes and frames since the last line
+        self.frames = 0
+
+    def update(self, episode=0, frames=0, epsilon=0, means=None):
+        # means: {label: recent mean reward}
+        self.done += 1
+        self.frames += frames
+        now = time.perf_counter()
+        elapsed = now - self.last
+        if elapsed < self.interval and episode + 1 < self.episodes:
+            return
+        rewards = '  '.join('{} {:.2f}'.format(label, mean) for label, mean in means.items())
+        self.writer.write('Episode {}/{}  {:.2f} episodes/sec  {:.1f} frames/sec  epsilon {:.4f}  mean reward {}\n'.format(
+            episode + 1, self.episodes, self.done / elapsed, self.frames / elapsed, epsilon, rewards))
+        self.last = now
+        self.done = 0
+        self.frames = 0
+
+
+class TraceBuffer():
+    # per-action trace as fixed-size binary records, written in batches through a LogWriter; read with read_trace()
+    DTYPE = np.dtype([('serial', '<i8'), ('event', 'u1'), ('choice', '<i2'), ('mx', '<f4'), ('my', '<f4')])
+    MOVE, ATE = 0, 1  # ATE records keep the number eaten in choice
+    BATCH = 4096
+
+    def __init__(self, filename=None, batch=BATCH):
+        self.writer = LogWriter(filename, binary=True)
+        self.batch = batch
+        self.pending = []
+
+    def add(self, serial=0, event=MOVE, choice=0, mx=0, my=0):
+        self.pending.append((serial, event, choice, mx, my))
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.writer.write(np.array(self.pending, dtype=self.DTYPE).tobytes())
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def read_trace(filename=None):
+    return np.fromfile(filename, dtype=TraceBuffer.DTYPE)
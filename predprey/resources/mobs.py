@@ -1,19 +1,18 @@
-import random
+import os
 import math
+import json
+import struct
 import numpy as np
 import pickle
 import time
 import matplotlib.pyplot as plt
 
-try:
-    import pygame_sdl2
-    pygame_sdl2.import_as_pygame()
-except ImportError:
-    pass
-import pygame
+from resources.returns import LEARNERS
+from resources.render import draw_mob
+from resources.rng import WorldRNG
 
 
-WHITE = (255, 255, 255)
+MAX_MOVES = 1000  # history kept for show_moves = True
 
 
 def angle(coords=(0,0)):
@@ -22,8 +21,9 @@ def angle(coords=(0,0)):
     
     x, y = coords
     
-    r2d = 180 / np.pi
-    ang = np.arctan2(x, -1*y) * r2d
+    r2d = 180 / math.pi
+    # 0.0 - y, not -1*y: a zero y is then +0.0 from ints and floats alike, so a zero offset is 0 degrees on both engines
+    ang = math.atan2(x, 0.0 - y) * r2d  # may differ from np.arctan2 in the last bit, which only matters on a quad edge
     
     return ang
 
@@ -32,12 +32,124 @@ def distance(coords=(0,0)):
     if not isinstance(coords, (list, tuple)) or len(coords) < 2:
         return None
     
-    return ((coords[0]**2)+(coords[1]**2))**0.5
+    # x*x and math.sqrt are correctly rounded, as numpy's elementwise ops are; ** goes through pow(), which
+    # is not, so the batched World engine could not match it bit for bit
+    return math.sqrt(coords[0] * coords[0] + coords[1] * coords[1])
+
+
+def choice_delta(choice=0, speed=(0, 0)):
+    # 18 possible actions: move in 8 inter/cardinal directions, at wander/run pace
+    # 17 is random
+    # 0 is hold
+    # 1 is north/wander, clockwise to 8
+    # 9 is north/run, clockwise to 16
+
+    # east/west component
+    if choice in (2, 3, 4, 10, 11, 12):
+        dx = 1
+    elif choice in (6, 7, 8, 14, 15, 16):
+        dx = -1
+    else:
+        dx = 0
+    
+    # north/south component
+    if choice in (8, 1, 2, 16, 9, 10):
+        dy = -1  # flipped for pixels!
+    elif choice in (4, 5, 6, 12, 13, 14):
+        dy = 1
+    else:
+        dy = 0
+    
+    if choice > 8:
+        run = True
+        dx *= speed[1]
+        dy *= speed[1]
+    else:
+        run = False
+        dx *= speed[0]
+        dy *= speed[0]
+    
+    return dx, dy, run
+
+
+def step_size(dx=0, dy=0, run=False, speed=(0, 0)):
+    ds = (dx ** 2 + dy ** 2) ** 0.5
+    if ds != 0:
+        scale = speed[1] / ds if run else speed[0] / ds
+    else:
+        scale = 0
+    mx = round(dx * scale, 2)
+    my = round(dy * scale, 2)
+    
+    return mx, my
+
+
+class MoveHistory():
+    # fixed-capacity ring buffer of past positions, oldest first
+    __slots__ = ('points', 'start', 'count')
+    
+    def __init__(self, capacity=0):
+        self.points = np.zeros((capacity, 2))
+        self.start = 0
+        self.count = 0
+    
+    def __len__(self):
+        return self.count
+    
+    def append(self, point):
+        capacity = len(self.points)
+        self.points[(self.start + self.count) % capacity] = point
+        if self.count < capacity:
+            self.count += 1
+        else:
+            self.start = (self.start + 1) % capacity
+    
+    def clear(self):
+        self.start = 0
+        self.count = 0
+    
+    def ordered(self):
+        return np.roll(self.points, -self.start, axis=0)[:self.count]
+
+
+class Q_view():
+    # dict-style access to a dense Q table by ((quad, band), (quad, band)) key, as the old dict tables were
+    
+    def __init__(self, q_table=None):
+        self.q_table = q_table
+    
+    def __getitem__(self, q_key):
+        return self.q_table.values[self.q_table.index(q_key)]  # a view, so row[choice] = q writes through
+    
+    def __setitem__(self, q_key, row):
+        self.q_table.values[self.q_table.index(q_key)] = row
+    
+    def __contains__(self, q_key):
+        return q_key in self.q_table.keys()
+    
+    def __iter__(self):
+        return iter(self.q_table.keys())
+    
+    def __len__(self):
+        return len(self.q_table.keys())
+    
+    def keys(self):
+        return self.q_table.keys()
+    
+    def items(self):
+        return [(q_key, self[q_key]) for q_key in self.q_table.keys()]
 
 
 class Q_table():
+    # binary table files: MAGIC, then a little-endian uint16 version and uint32 header length, a JSON header
+    # (shape, dtype, bin edges, trainer info), padding to ALIGN bytes, then the raw C-order values
+    MAGIC = b'PPQTABLE'
+    VERSION = 1
+    ALIGN = 64
+    EXT = 'qt'
+    replay = None  # ReplayBuffer, when updates are batched (--replay)
     
-    def __init__(self, r=0, bands=4, slices=8, actions=18, load=False):
+    def __init__(self, r=0, bands=4, slices=8, actions=18, load=False, dtype=np.float64, rng=None):
         slices = int(slices) if slices >= 8 else 8  # at least 1 per move direction
         bands = int(bands) if bands >= 4 else 4  # range discrimination
         theta = 360 / slices
@@ -49,24 +161,116 @@ class Q_table():
         
         self.angle_bounds = (self.quads[0][0], self.quads[-1][-1])
         self.range_bounds = (0, r)
+        self.edges = (np.array(self.quads, dtype=float), np.array(self.ranges, dtype=float))  # for discretize
+        
+        # one contiguous array indexed [target quad, target band, flee quad, flee band, action]
+        # None takes the last slot of each state axis, so -1 (as from discretize) is the None state
+        self.shape = (slices + 1, bands + 1, slices + 1, bands + 1, actions)
+        self.table = Q_view(self)
         
         if load:
             print('Loading Q table from {}'.format(load))
-            with open(load, 'rb') as f:
-                self.table = pickle.load(f)
+            self.values = self.load(load, dtype=dtype)
         else:
-            self.table = self.q_table_setup(actions=actions)
-        
-    def q_table_setup(self, actions=1):
-        table = {}
+            self.values = self.q_table_setup(actions=actions, dtype=dtype, rng=rng)
         
+    def q_table_setup(self, actions=1, dtype=np.float64, rng=None):
         # keys will be tuples of "quadrants" and range bands, which are stored as [L, R) angles and [min, max) distance respectively
-        angle_keys = [None] + list(range(len(self.quads)))
-        range_keys = [None] + list(range(len(self.ranges)))
+        # full keys pair the target and flee states: ((quad, band), (quad, band))
+        # starting values come from rng (a WorldRNG), drawn in the same key order as the old dict tables
+        states = len(self.states())
+        start = (rng or WorldRNG()).generator.uniform(-actions, 0, size=(states, states, actions-1))
         
-        table = {(a, r): [np.random.uniform(-actions, 0) for i in range(actions-1)] + [0] for a in angle_keys for r in range_keys}  # random action starts at 0
+        values = np.zeros(self.shape, dtype=dtype)  # random action starts at 0
+        for t, t_state in enumerate(self.states()):
+            for f, f_state in enumerate(self.states()):
+                values[self.index((t_state, f_state))][:actions-1] = start[t, f]
         
-        return table
+        return values
+    
+    def load(self, filename, dtype=np.float64):
+        header, offset = self.read_header(filename)
+        if header is None:  # pickled .Q from before the binary format; only unpickle files you trust
+            with open(filename, 'rb') as f:
+                return self.from_saved(pickle.load(f), dtype=dtype)
+        
+        if tuple(header['shape']) != self.shape:
+            raise ValueError('{} holds a table of shape {}, expected {}'.format(filename, tuple(header['shape']), self.shape))
+        if not np.allclose(header['quads'], self.quads) or not np.allclose(header['ranges'], self.ranges):
+            raise ValueError('{} was trained with different angle/range bins'.format(filename))
+        
+        # copy-on-write: mobs loading the same file share its pages until they learn something
+        values = np.memmap(filename, dtype=np.dtype(header['dtype']), mode='c', offset=offset, shape=self.shape)
+        return values if values.dtype == dtype else values.astype(dtype)
+    
+    @classmethod
+    def read_header(cls, filename):
+        # (header dict, payload offset), or (None, 0) for a file that is not in the binary format
+        with open(filename, 'rb') as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                return None, 0
+            version, length = struct.unpack('<HI', f.read(6))
+            if version > cls.VERSION:
+                raise ValueError('{} is Q table format version {}, newer than {}'.format(filename, version, cls.VERSION))
+            header = json.loads(f.read(length).decode('utf-8'))
+        
+        offset = len(cls.MAGIC) + 6 + length
+        return header, offset + (-offset) % cls.ALIGN
+    
+    def write(self, filename, info=None):
+        values = np.ascontiguousarray(self.values)
+        header = json.dumps({'shape': list(values.shape), 'dtype': values.dtype.str,
+                             'quads': self.quads, 'ranges': self.ranges, 'actions': self.actions,
+                             'info': info or {}}).encode('utf-8')
+        offset = len(self.MAGIC) + 6 + len(header)
+        
+        # values may be mapped from filename itself (see load), so write beside it and swap it in
+        partial = '{}.tmp'.format(filename)
+        with open(partial, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack('<HI', self.VERSION, len(header)))
+            f.write(header)
+            f.write(b'\0' * ((-offset) % self.ALIGN))
+            f.write(values.tobytes())
+        os.replace(partial, filename)
+    
+    def from_saved(self, saved, dtype=np.float64):
+        if isinstance(saved, np.ndarray):
+            if saved.shape != self.shape:
+                raise ValueError('Q table of shape {} does not fit {}'.format(saved.shape, self.shape))
+            return saved.astype(dtype, copy=False)
+        
+        # old pickled dict tables, keyed by target state only or by (target, flee) states
+        values = np.zeros(self.shape, dtype=dtype)
+        for q_key, row in saved.items():
+            values[self.index(self.saved_key(q_key))] = row
+        return values
+    
+    @staticmethod
+    def saved_key(q_key):
+        # a pickled table's key as a (target, flee) q_key; the oldest tables keyed on the target
+        # state (quad, band) alone, which is a (target, flee) key with no flee
+        if isinstance(q_key, tuple) and len(q_key) == 2:
+            if all(isinstance(state, tuple) and len(state) == 2 for state in q_key):
+                return q_key
+            if not any(isinstance(part, tuple) for part in q_key):
+                return q_key, (None, None)
+        raise ValueError('Q table key {!r} is neither (quad, band) nor ((quad, band), (quad, band))'.format(q_key))
+    
+    def states(self):
+        angle_keys = [None] + list(range(len(self.quads)))
+        range_keys = [None] + list(range(len(self.ranges)))
+        return [(a, r) for a in angle_keys for r in range_keys]
+    
+    def keys(self):
+        return [(t, f) for t in self.states() for f in self.states()]
+    
+    def index(self, q_key):
+        (t_quad, t_band), (f_quad, f_band) = q_key
+        return (-1 if t_quad == None else t_quad,
+                -1 if t_band == None else t_band,
+                -1 if f_quad == None else f_quad,
+                -1 if f_band == None else f_band)
     
     def get_quad(self, theta):
         if theta == None:
@@ -77,23 +281,61 @@ class Q_table():
         while theta > self.angle_bounds[1]:
             theta -= 360
         
-        for num, key in enumerate(self.quads):
-            low, high = key
-            if low <= theta < high:
-                return num
-        
-        return None
+        return self.find_bin(theta, self.quads, self.angle_bounds[0], 360 / len(self.quads))
     
     def get_range(self, r):
         if r == None:
             return None
         
-        for num, key in enumerate(self.ranges):
-            low, high = key
-            if low <= r < high:
-                return num
+        return self.find_bin(r, self.ranges, self.range_bounds[0], self.range_bounds[1] / len(self.ranges))
+    
+    @staticmethod
+    def find_bin(value, bins, origin, width):
+        # closed-form guess at the [low, high) bin, then checked against the stored edges so
+        # float rounding at a boundary lands exactly where the old linear scan did
+        if width <= 0:
+            return None
+        guess = int(math.floor((value - origin) / width))
+        for num in (guess - 1, guess, guess + 1):
+            if 0 <= num < len(bins):
+                low, high = bins[num]
+                if low <= value < high:
+                    return num
         
         return None
+    
+    def discretize(self, dx=(), dy=()):
+        # batched observe(): quad and band index for each (dx, dy) offset, -1 where get_quad/get_range
+        # would give None; a NaN offset means no target
+        dx = np.asarray(dx, dtype=float)
+        dy = np.asarray(dy, dtype=float)
+        seen = ~(np.isnan(dx) | np.isnan(dy))
+        
+        theta = np.arctan2(dx, 0.0 - dy) * (180 / np.pi)  # 0.0 - dy, as in angle()
+        theta = np.where(theta < self.angle_bounds[0], theta + 360, theta)  # arctan2 is within one turn
+        theta = np.where(theta > self.angle_bounds[1], theta - 360, theta)
+        rng = np.sqrt(dx**2 + dy**2)
+        
+        quad = self.find_bins(theta, self.edges[0])
+        band = self.find_bins(rng, self.edges[1])
+        quad[~seen] = -1
+        band[~seen] = -1
+        
+        return quad, band
+    
+    @staticmethod
+    def find_bins(values, bins):
+        # vectorized find_bin: lowest [low, high) bin holding each value, -1 for none
+        bins = np.asarray(bins, dtype=float)
+        lows, highs = bins[:, 0], bins[:, 1]
+        
+        num = np.searchsorted(lows, values, side='right') - 1
+        prev = np.maximum(num - 1, 0)
+        cur = np.maximum(num, 0)
+        in_prev = (num >= 1) & (lows[prev] <= values) & (values < highs[prev])
+        in_cur = (num >= 0) & (values < highs[cur])
+        
+        return np.where(in_prev, prev, np.where(in_cur, cur, -1))
 
     def plot_q(self, filename, tgt=True):
         # plot: rows for range, cols for quad (where tgt is) plus 1 for None
@@ -123,7 +365,7 @@ class Q_table():
                     while f > len(styles) - 1:
                         f -= len(styles)  # there is probably a better way to do this...intertools.cycle?
                     fmt = '--{}'.format(styles[f])
-                    axes[r, c].plot(self.table[key], fmt, label=self.ranges[l])
+                    axes[r, c].plot(self.table[key], fmt, label=str(self.ranges[l]))
                     line_minmax[0] = line_minmax[0] if line_minmax[0] <= min(self.table[key]) else min(self.table[key])
                     line_minmax[1] = line_minmax[1] if line_minmax[1] >= max(self.table[key]) else max(self.table[key])
                 axes[r,c].set_title(self.quads[q])
@@ -138,15 +380,26 @@ class Q_table():
         plt.savefig(filename)  # needs to include directory structure
         plt.close()
     
-    def save(self, directory, mob_type, serial, key):
-        filename = '{}/{}-{}-{}.Q'.format(directory, mob_type, serial, key)
+    def save(self, directory, mob_type, serial, info=None):
+        os.makedirs(directory, exist_ok=True)
+        filename = '{}/{}-{}.{}'.format(directory, mob_type, serial, self.EXT)
         print('Saving Q table as {}'.format(filename))
-        with open(filename, 'wb') as f:  # microseconds
-            pickle.dump(self.table, f)
+        self.write(filename, info=info)
 
 
 class Mob():
+    __slots__ = ('x', 'y', 'health_init', 'health', 'alive', 'serial', 'target', 'flee', 'speed',
+                 'moves', 'color', 'show_moves', 'q_table', 'returns')
+    record_moves = True  # main.py turns this off unless the episode is rendered
+    rng = WorldRNG()  # the world's randomness; main.seed_rng() replaces it with a seeded one
     sight = 0
+    bands = 0
+    slices = 0
+    learning_rate = 0  # 0: no learning, 1: no memory
+    discount = 0  # 0: no time preference, 1: infinite time preference
+    learner = 'one-step'  # or 'n-step', 'lambda': see resources/returns.py
+    n_step = 4  # rewards per n-step return
+    trace_decay = 0.8  # lambda, for Q(lambda)
     
     def __init__(self, x=None, y=None, dims=None):
         if not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
@@ -163,17 +416,14 @@ class Mob():
         self.flee = [None, None]
         
         #self.sight = 0
-        self.slices = 0
         self.speed = (0, 0)
-        self.moves = [(self.x, self.y)]
+        self.moves = None  # MoveHistory sized by show_moves, see clear_moves()
         
         self.color = (0, 0, 0)
-        self.show_moves = False  # False or number (True for all)
+        self.show_moves = False  # False or number (True for MAX_MOVES)
         
-        self.learning_rate = 0  # 0: no learning, 1: no memory
-        self.discount = 0  # 0: no time preference, 1: infinite time preference
-        
-        self.q_table = {'target': None, 'flee': None}
+        self.q_table = None  # keyed on both target and flee states
+        self.returns = None  # multi-step learner, made on first use
         
     def __str__(self):
         return '{} at ({}, {})'.format(self.__class__, self.x, self.y)
@@ -187,7 +437,7 @@ class Mob():
     
     @property
     def r(self):
-        return self.health ** 0.5
+        return math.sqrt(self.health)
         
     def reset(self, x=None, y=None):
         if not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
@@ -199,38 +449,64 @@ class Mob():
         self.alive = True
         self.target[1] = None
         self.flee[1] = None
-        self.moves = []
-        
-    def observe(self, mobs=None):
-        # prevent mobs from switching targets too much
+        self.clear_moves()
+    
+    @classmethod
+    def new_q_table(cls, load=False):
+        return Q_table(r=cls.sight, bands=cls.bands, slices=cls.slices, load=load, rng=cls.rng)
+    
+    @classmethod
+    def q_info(cls):
+        # what a saved table was trained with
+        return {'species': cls.__name__, 'sight': cls.sight, 'bands': cls.bands, 'slices': cls.slices,
+                'learning_rate': cls.learning_rate, 'discount': cls.discount}
+    
+    def clear_moves(self):
+        capacity = 0 if not self.show_moves else MAX_MOVES if self.show_moves == True else int(self.show_moves)
+        if capacity == 0:
+            self.moves = None
+        elif self.moves is None or len(self.moves.points) != capacity:
+            self.moves = MoveHistory(capacity)
+        else:
+            self.moves.clear()
+    
+    def record(self):
+        if self.record_moves and self.moves is not None:
+            self.moves.append((self.x, self.y))
+        
+    def closest(self, mob_list=(), current=None, delta=0):
+        # prevent mobs from switching targets too much: only switch when closer by delta
+        limit = None if current == None else distance(current - self) - delta
+        for mob in mob_list:
+            if mob.alive:
+                ds = distance(mob - self)
+                if limit == None or ds < limit:
+                    current = mob
+                    limit = ds - delta
+        
+        return current
+
+    def observe(self, mobs=None, index=None):
         delta = self.speed[1] + self.speed[0]  # how much closer to switch targets/flee
         
         for mob_type, mob_list in mobs.items():
-            if mob_type == self.target[0]:
-                for mob in mob_list:
-                    ds = distance(mob - self)
-                    if mob.alive and (self.target[1] == None or ds < distance(self.target[1] - self) - delta):
-                        self.target[1] = mob
+            if mob_type in (self.target[0], self.flee[0]) and index:
+                mob_list = [mob_list[i] for i in index.near(mob_type, self.x, self.y, self.sight)]
             
+            if mob_type == self.target[0]:
+                self.target[1] = self.closest(mob_list, self.target[1], delta)
             elif mob_type == self.flee[0]:
-                for mob in mob_list:
-                    ds = distance(mob - self)
-                    if mob.alive and (self.flee[1] == None or ds < distance(self.flee[1] - self) - delta):
-                        self.flee[1] = mob
-        
-        if self.target[1] != None and distance(self.target[1] - self) > self.sight:
-            self.target[1] = None
-        if self.flee[1] != None and distance(self.flee[1] - self) > self.sight:
-            self.flee[1] = None
+                self.flee[1] = self.closest(mob_list, self.flee[1], delta)
         
         q_key = []
-        for mob in (self.target[1], self.flee[1]):
-            theta = None if mob == None else angle(mob - self)
-            #t.append(theta)
-            quad = self.q_table.get_quad(theta)
+        for link in (self.target, self.flee):
+            rng = None if link[1] == None else distance(link[1] - self)
+            if rng != None and rng > self.sight:
+                link[1] = None
+                rng = None
             
-            rng = None if mob == None else distance(mob - self)
-            #r.append(rng)
+            theta = None if link[1] == None else angle(link[1] - self)
+            quad = self.q_table.get_quad(theta)
             band = self.q_table.get_range(rng)
             q_key.append((quad, band))
         
@@ -238,63 +514,29 @@ class Mob():
 
         return q_key
 
-    def action(self, epsilon=0, q_key=None, max_dims=(0, 0)):
-        #t = []
-        #r = []
-        
-        if random.random() > epsilon:
-            choice = np.argmax(self.q_table.table[q_key])
+    def choose(self, epsilon=0, q_key=None):
+        if self.rng.uniform() > epsilon:
+            choice = self.q_table.values[self.q_table.index(q_key)].argmax()
         else:
-            choice = random.randint(0,16)
-
-        # 18 possible actions: move in 8 inter/cardinal directions, at wander/run pace
-        # 17 is random
-        # 0 is hold
-        # 1 is north/wander, clockwise to 8
-        # 9 is north/run, clockwise to 16
-
-        if choice == 17:
-            choice = random.randint(0,16)
-
-        # east/west component
-        if choice in (2, 3, 4, 10, 11, 12):
-            dx = 1
-        elif choice in (6, 7, 8, 14, 15, 16):
-            dx = -1
-        else:
-            dx = 0
-        
-        # north/south component
-        if choice in (8, 1, 2, 16, 9, 10):
-            dy = -1  # flipped for pixels!
-        elif choice in (4, 5, 6, 12, 13, 14):
-            dy = 1
-        else:
-            dy = 0
+            choice = self.rng.action()
+
+        if choice == 17:  # random
+            choice = self.rng.action()
         
-        if choice > 8:
-            run = True
-            dx *= self.speed[1]
-            dy *= self.speed[1]
-        else:
-            run = False
-            dx *= self.speed[0]
-            dy *= self.speed[0]
+        return choice
+
+    def action(self, epsilon=0, q_key=None, max_dims=(0, 0)):
+        choice = self.choose(epsilon=epsilon, q_key=q_key)
+        dx, dy, run = choice_delta(choice=choice, speed=self.speed)
             
         mx, my = self.move(dx=dx, dy=dy, run=run, max_dims=max_dims)
-        return mx, my, choice  #, t, r
+        return mx, my, choice
         
     def move(self, dx=None, dy=None, run=False, max_dims=(0, 0)):
-        dx = dx if isinstance(dx, (int, float)) else random.randint(0, self.speed[1])
-        dy = dy if isinstance(dy, (int, float)) else random.randint(0, self.speed[1])
+        dx = dx if isinstance(dx, (int, float)) else self.rng.integers(0, int(self.speed[1]))
+        dy = dy if isinstance(dy, (int, float)) else self.rng.integers(0, int(self.speed[1]))
         
-        ds = (dx ** 2 + dy ** 2) ** 0.5
-        if ds != 0:
-            scale = self.speed[1] / ds if run else self.speed[0] / ds
-        else:
-            scale = 0
-        mx = round(dx * scale, 2)
-        my = round(dy * scale, 2)
+        mx, my = step_size(dx=dx, dy=dy, run=run, speed=self.speed)
 
         mx = 0 - self.x if self.x + mx < 0 else mx  # left bound
         mx = max_dims[0] - self.x if max_dims[0] < self.x + mx else mx  # right bound
@@ -304,21 +546,30 @@ class Mob():
         my = max_dims[1] - self.y if max_dims[1] < self.y + my else my  # lower bound
         self.y += my
         
-        self.moves.append((self.x, self.y))
+        self.record()
         return mx, my
         
-    def check(self, mobs=None, mx=0, my=0):
+    def touching(self, mob_type=None, mob_list=(), index=None, after=-1):
+        # list positions (past after) of mobs that could overlap this one
+        if not index:
+            return list(range(after + 1, len(mob_list)))
+        return [i for i in index.near(mob_type, self.x, self.y, self.r + index.reach[mob_type]) if i > after]
+
+    def check(self, mobs=None, mx=0, my=0, index=None):
         move_reward = -1  # turn penalty
-        move_reward -= (mx**2 + my**2) ** 0.5  # move penalty
+        move_reward -= math.sqrt(mx * mx + my * my)  # move penalty
         act_reward = 0
 
         eaten_mobs = []
         
         for mob_type, mob_list in mobs.items():
             if mob_type == self.target[0]:
-                for mob in mob_list:
-                    ds = distance(mob - self)
-                    if mob.alive and ds < (self.r + mob.r):
+                pending = self.touching(mob_type, mob_list, index)
+                k = 0
+                while k < len(pending):
+                    mob = mob_list[pending[k]]
+                    k += 1
+                    if mob.alive and distance(mob - self) < (self.r + mob.r):
                         # eat the prey/food, be rewarded
                         self.health += mob.health
                         act_reward += mob.health_init
@@ -326,22 +577,36 @@ class Mob():
                         mob.health = 0
                         mob.alive = False
                         eaten_mobs.append(mob.serial)
+                        
+                        if index:  # bigger now, so more might be in reach
+                            index.grow(self.__class__.__name__, self.r)
+                            pending = pending[:k] + sorted(set(pending[k:]) | set(self.touching(mob_type, mob_list, index, after=pending[k-1])))
             elif mob_type == self.flee[0]:
-                for mob in mob_list:
-                    ds = distance(mob - self)
-                    if mob.alive and ds < (self.r + mob.r):
+                for mob in [mob_list[i] for i in self.touching(mob_type, mob_list, index)]:
+                    if mob.alive and distance(mob - self) < (self.r + mob.r):
                         # pentalty for being eaten
                         act_reward -= self.health_init
         
         reward = (move_reward, act_reward)
         return reward, eaten_mobs
 
-    def update_q(self, mobs=None, q_key=((None, None), (None, None)), choice=-1, reward=0):
+    def update_q(self, mobs=None, q_key=((None, None), (None, None)), choice=-1, reward=0, index=None):
+        if self.q_table.replay is not None:
+            self.q_table.replay.push(mob=self, q_key=q_key, choice=choice, reward=reward)  # learned later, in a batch
+            return
         # make recursive based on subsequent repeats of same action, or best action?
-        current_q = self.q_table.table[q_key][choice]
-
-        new_q_key = self.observe(mobs=mobs)  # sentdex for advice
-        max_future_q = np.max(self.q_table.table[new_q_key])
+        new_q_key = self.observe(mobs=mobs, index=index)  # sentdex for advice
+        self.learn(q_key=q_key, choice=choice, reward=reward, new_q_key=new_q_key)
+
+    def learn(self, q_key=((None, None), (None, None)), choice=-1, reward=0, new_q_key=((None, None), (None, None))):
+        if self.learner != 'one-step':
+            if self.returns is None:
+                self.returns = LEARNERS[self.learner](self)
+            self.returns.step(q_key=q_key, choice=choice, reward=reward, new_q_key=new_q_key)
+            return
+        row = self.q_table.values[self.q_table.index(q_key)]
+        current_q = row[choice]
+        max_future_q = self.q_table.values[self.q_table.index(new_q_key)].max()
 
         move_reward, act_reward = reward
         reward_sum = move_reward + act_reward
@@ -350,51 +615,33 @@ class Mob():
         else:
             new_q = (1 - self.learning_rate) * current_q + self.learning_rate * (reward_sum + self.discount * max_future_q)
 
-        self.q_table.table[q_key][choice] = new_q
+        row[choice] = new_q
         
+    def snapshot(self):
+        # what resources.render draws, as plain values the sim won't change underneath it
+        trail = None
+        if self.moves is not None and len(self.moves) > 0:
+            trail = self.moves.ordered().tolist() + [(self.x, self.y)]
+        target = (self.target[1].x, self.target[1].y) if self.target[1] else None
+        flee = (self.flee[1].x, self.flee[1].y) if self.flee[1] else None
+        return (self.color, self.x, self.y, self.r, self.sight, trail, target, flee)
+
     def display(self, gameDisplay=None):
         if gameDisplay:
-            
-            # show move history
-            if self.show_moves and len(self.moves) > 0:
-                if self.show_moves == True:
-                    start = 0
-                elif len(self.moves) < self.show_moves:
-                    start = 0
-                else:
-                    start = len(self.moves) - self.show_moves
-                for pt in range(start, len(self.moves) - 1):
-                    pygame.draw.line(gameDisplay, self.color, self.moves[pt], self.moves[pt+1], 1)
-                pygame.draw.line(gameDisplay, self.color, self.moves[-1], (self.x, self.y), 1)
-            
-            # show current location
-            try:
-                pygame.draw.ellipse(gameDisplay, self.color, (self.x - self.r, self.y - self.r, self.r * 2, self.r * 2))  # physical, pygame
-            except:
-                pygame.draw.circle(gameDisplay, self.color, (self.x, self.y), self.r)  # pygame_sdl2
-            
-            # show target/flee
-            if self.target[1]:
-                pygame.draw.line(gameDisplay, WHITE, (self.target[1].x, self.target[1].y), (self.x, self.y), 1)
-            #elif self.target[0] != None:
-                #pygame.draw.line(gameDisplay, WHITE, (0, 0), (self.x, self.y), 1)
-            if self.flee[1]:
-                pygame.draw.line(gameDisplay, WHITE, (self.flee[1].x, self.flee[1].y), (self.x, self.y), 3)
-            #elif self.flee[0] != None:
-                #pygame.draw.line(gameDisplay, WHITE, (self.max_x, self.max_y), (self.x, self.y), 1)
-            
-            # show sight ring
-            if self.sight >= 1:
-                try:
-                    pygame.draw.ellipse(gameDisplay, self.color, (self.x - self.sight, self.y - self.sight, self.sight * 2, self.sight * 2), 1)  # sight range, pygame
-                except:
-                    pygame.draw.circle(gameDisplay, self.color, (self.x, self.y), self.sight, width=1)  # pygame_sdl2
-        
+            draw_mob(gameDisplay, self.snapshot())
         else:
             raise RuntimeError('Error drawing {}'.format(self.__class__))
 
 
 class Food(Mob):
+    # passive: grows by GROWTH a frame while alive, worked out when health is read rather than ticked,
+    # so main.mob_update never visits food; growth follows Food.clock, the frames this world has run
+    __slots__ = ('base', 'born')  # health when last set, and the clock then
+    GROWTH = 0.2
+    clock = 0  # advanced by main.mob_update; one world per process, as Mob.rng
+    eaten = 0  # food eaten this episode, counted by main.mob_update
+    grown = {}  # base: [base after 0, 1, 2, ... frames], summed as ticking would, so results are unchanged
+    
     def __init__(self, x=None, y=None):
         if not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
             raise ValueError('Food not passed position in init!')
@@ -404,11 +651,28 @@ class Food(Mob):
         self.health = self.health_init
         self.color = (0, 255, 0)
     
+    @property
+    def health(self):
+        frames = Food.clock - self.born
+        if frames == 0 or not self.alive:  # eaten food stays eaten
+            return self.base
+        try:
+            return Food.grown[self.base][frames]
+        except (KeyError, IndexError):
+            values = Food.grown.setdefault(self.base, [self.base])
+            while len(values) <= frames:
+                values.append(values[-1] + self.GROWTH)  # grow!
+            return values[frames]
+    
+    @health.setter
+    def health(self, value):
+        self.base = value
+        self.born = Food.clock
+    
     def observe(self, *args, **kwargs):
         return None, None  # return a tuple of no target/flee
     def action(self, *args, **kwargs):
-        self.health += 0.2  # grow!
-        return 0, 0, 0
+        return 0, 0, 0  # growth is worked out from Food.clock, see health
     def check(self, *args, **kwargs):
         return (0,0), []
     def update_q(self, *args, **kwargs):
@@ -416,9 +680,14 @@ class Food(Mob):
 
 
 class Prey(Mob):
+    __slots__ = ()
     sight = 60
+    bands = 4
+    slices = 8
+    learning_rate = 0.08
+    discount = 0.67
     
-    def __init__(self, x=None, y=None, load=False):
+    def __init__(self, x=None, y=None, load=False, q_table=None):
         if not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
             raise ValueError('Prey not passed position in init!')
         super().__init__(x=x, y=y)
@@ -430,28 +699,24 @@ class Prey(Mob):
         self.flee = ['Predator', None]
         
         #self.sight = 60
-        self.bands = 4
-        self.slices = 8
         self.speed = (self.health_init ** 0.5, self.sight / 4)  # wander, run
         
         self.color = (0, 0, 255)
         self.show_moves = 100
         
-        self.learning_rate = 0.08
-        self.discount = 0.67
-        
-        if not load:
-            for key in self.q_table:
-                self.q_table[key] = Q_table(r=self.sight, bands=self.bands, slices=self.slices)
-        else:
-            for key in self.q_table:
-                self.q_table[key] = Q_table(r=self.sight, bands=self.bands, slices=self.slices, load=load)
+        self.q_table = q_table if q_table is not None else self.new_q_table(load=load)  # q_table: a policy shared with other mobs
 
 
 class Predator(Mob):
+    __slots__ = ()
+    trace = None  # TraceBuffer of every action, when tracing is on (--trace)
     sight = 100
+    bands = 8
+    slices = 16
+    learning_rate = 0.12  # faster learner
+    discount = 0.9  # with better time pref than prey
     
-    def __init__(self, x=None, y=None, load=False):
+    def __init__(self, x=None, y=None, load=False, q_table=None):
         if not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
             raise ValueError('Predator not passed position in init!')
         super().__init__(x=x, y=y)
@@ -462,43 +727,27 @@ class Predator(Mob):
         self.target = ['Prey', None]
         
         #self.sight = 200
-        self.bands = 8
-        self.slices = 16
         self.speed = (self.health_init ** 0.5, self.sight / 4)
         
         self.color = (255, 0, 0)
         self.show_moves = True
         
-        self.learning_rate = 0.12  # faster learner
-        self.discount = 0.9  # with better time pref than prey
-        
-        if not load:
-            self.q_table['target'] = Q_table(r=self.sight, bands=self.bands, slices=self.slices)
-        else:
-            self.q_table['target'] = Q_table(r=self.sight, bands=self.bands, slices=self.slices, load=load)
-        
-        self.log = False  # open('resources/pred.log', 'w')
-        if self.log:
-            self.log.write('{}, {}\n'.format(self.__class__, self.serial))
-            #self.log.write('{}\n'.format(self.q_table['target'].table.keys()))
-            self.log.write('{}\n{}\n'.format(self.q_table['target'].quads, self.q_table['target'].ranges))
-            #self.log.write('{}\n'.format(self.q_table['target'].table))
+        self.q_table = q_table if q_table is not None else self.new_q_table(load=load)  # q_table: a policy shared with other mobs
 
     
     def action(self, epsilon=0, q_key=None, max_dims=(0, 0)):
         # movement logging for debugging
         mx, my, choice = super().action(epsilon=epsilon, q_key=q_key, max_dims=max_dims)  #t, r debug
         
-        if self.log:
-            self.log.write('choice: {:<2}  |  move: ({:>6}, {:>6})\n'.format(choice, round(mx, 2), round(my, 2)))
-            #self.log.write('angles: {}  |  ranges: {}\n'.format(t, r))
+        if self.trace is not None:
+            self.trace.add(self.serial, self.trace.MOVE, choice, mx, my)
             
         return mx, my, choice
 
-    def check(self, mobs=None, mx=0, my=0):
-        reward, eaten_mobs = super().check(mobs=mobs, mx=mx, my=my)
+    def check(self, mobs=None, mx=0, my=0, index=None):
+        reward, eaten_mobs = super().check(mobs=mobs, mx=mx, my=my, index=index)
         
-        if len(eaten_mobs) > 0 and self.log:
-            self.log.write('** ATE: {}\n'.format(eaten_mobs))
+        if len(eaten_mobs) > 0 and self.trace is not None:
+            self.trace.add(self.serial, self.trace.ATE, len(eaten_mobs))
         
         return reward, eaten_mobs
@@ -0,0 +1,269 @@
+import json
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+try:
+    import pygame_sdl2
+    pygame_sdl2.import_as_pygame()
+except ImportError:
+    pass
+import pygame
+
+
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+PAUSE = 1  # seconds an episode's end state stays up
+
+
+class Frame():
+    # everything needed to draw one sim frame, copied off the mobs so the sim can carry on while it is drawn
+    __slots__ = ('episode', 'frame', 'counts', 'mobs', 'pause')
+
+    def __init__(self, episode=0, frame=0, mobs=None, pause=False):
+        self.episode = episode
+        self.frame = frame
+        self.counts = [(key, sum(mob.alive for mob in mob_list), len(mob_list)) for key, mob_list in mobs.items()]
+        self.mobs = [mob.snapshot() for mob_list in mobs.values() for mob in mob_list if mob.alive]
+        self.pause = pause  # hold this frame for PAUSE seconds, e.g. an episode's end state
+
+
+class Sprites():
+    # mob bodies pre-drawn per (colour, radius bucket) and sight rings per (colour, sight), so a frame is blits
+    STEP = 0.5  # radius bucket, in pixels
+
+    def __init__(self):
+        self.bodies = {}
+        self.rings = {}
+
+    def sprite(self, r=0, color=BLACK, width=0):
+        size = int(math.ceil(r * 2)) + 2
+        sprite = pygame.Surface((size, size))
+        sprite.set_colorkey(BLACK, pygame.RLEACCEL)  # black is the background, never a mob
+        try:
+            pygame.draw.ellipse(sprite, color, (1, 1, r * 2, r * 2), width)  # pygame
+        except:
+            pygame.draw.circle(sprite, color, (size / 2, size / 2), r, width=width)  # pygame_sdl2
+        return sprite
+
+    def body(self, color=BLACK, r=0):
+        key = (color, round(r / self.STEP))
+        if key not in self.bodies:
+            self.bodies[key] = self.sprite(key[1] * self.STEP, color)
+        return self.bodies[key]
+
+    def ring(self, color=BLACK, sight=0):
+        key = (color, sight)
+        if key not in self.rings:
+            self.rings[key] = self.sprite(sight, color, width=1)
+        return self.rings[key]
+
+
+SPRITES = Sprites()
+
+
+def blit_centered(surface=None, sprite=None, x=0, y=0):
+    half = sprite.get_width() / 2
+    return surface.blit(sprite, (int(x - half), int(y - half)))
+
+
+def draw_mob(surface=None, snap=None, sprites=SPRITES):
+    # snap: Mob.snapshot(); returns the rects drawn on
+    color, x, y, r, sight, trail, target, flee = snap
+    rects = []
+
+    # show move history (already capped at show_moves), in one call
+    if trail is not None:
+        rects.append(pygame.draw.lines(surface, color, False, trail, 1))
+
+    # show current location
+    rects.append(blit_centered(surface, sprites.body(color, r), x, y))
+
+    # show target/flee
+    if target:
+        rects.append(pygame.draw.line(surface, WHITE, target, (x, y), 1))
+    if flee:
+        rects.append(pygame.draw.line(surface, WHITE, flee, (x, y), 3))
+
+    # show sight ring
+    if sight >= 1:
+        rects.append(blit_centered(surface, sprites.ring(color, sight), x, y))
+
+    return rects
+
+
+class Stats():
+    # the episode/frame and alive counts text; a line is only re-rendered when its text changes
+    SIZE = 32
+    SPACING = 40
+
+    def __init__(self):
+        self.font = None
+        self.lines = {}  # line number: (text, rendered surface)
+
+    def line(self, num=0, text=''):
+        if num not in self.lines or self.lines[num][0] != text:
+            if self.font is None:
+                self.font = pygame.font.SysFont(None, self.SIZE)
+            self.lines[num] = (text, self.font.render(text, True, WHITE))
+        return self.lines[num][1]
+
+    def draw(self, surface=None, frame=None):
+        texts = ['episode/frame: {}/{}'.format(frame.episode, frame.frame)]
+        texts += ['{}: {}/{}'.format(key, alive, total) for key, alive, total in frame.counts]
+        return [surface.blit(self.line(num, text), (0, num * self.SPACING)) for num, text in enumerate(texts)]
+
+
+def draw_frame(surface=None, frame=None, stats=None):
+    # draw onto whatever is there; returns the rects drawn on
+    rects = []
+    for snap in frame.mobs:
+        rects += draw_mob(surface, snap)
+    rects += stats.draw(surface, frame)
+    return rects
+
+
+class Canvas():
+    # a surface drawn frame over frame, erasing only the rects the previous frame drew on
+    # once those rects cover more than the surface (they overlap), one full fill is cheaper
+
+    def __init__(self, surface=None):
+        self.surface = surface
+        self.stats = Stats()
+        self.dirty = None  # rects the last frame drew on, None before the first
+
+    def paint(self, frame=None):
+        # returns the rects that changed, None for all of them
+        whole = self.dirty is None or sum(rect.w * rect.h for rect in self.dirty) > self.surface.get_width() * self.surface.get_height()
+        if whole:
+            self.surface.fill(BLACK)
+        else:
+            for rect in self.dirty:
+                self.surface.fill(BLACK, rect)
+        rects = draw_frame(self.surface, frame, stats=self.stats)
+        changed = None if whole else rects + self.dirty
+        self.dirty = rects
+        return changed
+
+
+class Renderer(Canvas):
+    # draws published Frames on its own thread, at most fps a second, so watching never slows the sim
+    # frames wait in a bounded queue; one published while it is full is dropped rather than waited for
+    # the display is only updated where the frame changed
+
+    def __init__(self, surface=None, fps=30, size=256):
+        super().__init__(surface)
+        self.fps = fps
+        self.frames = queue.Queue(maxsize=size)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.drawer, name='renderer', daemon=True)
+        self.thread.start()
+
+    def publish(self, frame=None):
+        try:
+            self.frames.put_nowait(frame)
+        except queue.Full:
+            self.dropped += 1
+
+    def drawer(self):
+        clock = pygame.time.Clock()
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                return
+            self.draw(frame)
+            clock.tick(self.fps)
+            if frame.pause:
+                time.sleep(PAUSE)
+
+    def draw(self, frame=None):
+        pygame.display.update(self.paint(frame))
+
+    def close(self):
+        # draw whatever is still queued, then stop
+        self.frames.put(None)
+        self.thread.join()
+
+
+class FrameWriter(Canvas):
+    # draws Frames offscreen and writes them out, per episode: a PNG per frame (directory/<name>-<episode>/<frame>.png),
+    # or one raw RGB stream (directory/<name>-<episode>.rgb, described by the .json beside it, e.g. for ffmpeg -f rawvideo)
+    FORMATS = ('png', 'raw')
+
+    def __init__(self, directory=None, name='run', dims=(0, 0), fps=30, fmt='png'):
+        pygame.font.init()  # no display needed, so this works headless
+        super().__init__(pygame.Surface(dims))
+        self.directory = directory
+        self.name = name
+        self.fps = fps
+        self.fmt = fmt
+        self.episode = None
+        self.path = None  # current episode's output, without extension
+        self.stream = None
+        self.written = 0
+
+    def add(self, frame=None):
+        if frame.episode != self.episode:
+            self.start_episode(frame.episode)
+        self.paint(frame)
+        if self.fmt == 'png':
+            pygame.image.save(self.surface, os.path.join(self.path, '{:05d}.png'.format(frame.frame)))
+        else:
+            self.stream.write(pygame.image.tobytes(self.surface, 'RGB'))
+        self.written += 1
+
+    def start_episode(self, episode=0):
+        self.end_episode()
+        self.episode = episode
+        self.path = os.path.join(self.directory, '{}-{:06d}'.format(self.name, episode))
+        if self.fmt == 'png':
+            os.makedirs(self.path, exist_ok=True)
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        width, height = self.surface.get_size()
+        with open(self.path + '.json', 'w') as f:
+            json.dump({'width': width, 'height': height, 'fps': self.fps, 'pix_fmt': 'rgb24'}, f)
+        self.stream = open(self.path + '.rgb', 'wb')
+
+    def end_episode(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+
+def write_frames(frames=None, *args):
+    # Recorder's encoder: FrameWriter(*args) fed from the frames queue until None
+    writer = FrameWriter(*args)
+    while True:
+        frame = frames.get()
+        if frame is None:
+            writer.end_episode()
+            return
+        writer.add(frame)
+
+
+class Recorder():
+    # hands Frames of recorded episodes to write_frames in another process, so drawing and encoding
+    # never hold the sim's GIL (a thread inside daemonic pool workers, which can't start processes)
+    # frames are never dropped: the sim only waits when the encoder is a whole queue behind
+
+    def __init__(self, directory=None, name='run', dims=(0, 0), fps=30, fmt='png', size=256):
+        if multiprocessing.current_process().daemon:
+            self.frames = queue.Queue(maxsize=size)
+            encoder = threading.Thread
+        else:
+            self.frames = multiprocessing.Queue(maxsize=size)
+            encoder = multiprocessing.Process
+        self.encoder = encoder(target=write_frames, args=(self.frames, directory, name, dims, fps, fmt), name='recorder', daemon=True)
+        self.encoder.start()
+
+    def publish(self, frame=None):
+        self.frames.put(frame)
+
+    def close(self):
+        # wait for every frame to reach disk
+        self.frames.put(None)
+        self.encoder.join()
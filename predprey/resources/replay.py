@@ -0,0 +1,87 @@
+import numpy as np
+
+
+class ReplayBuffer():
+    # one Q table's transitions in preallocated ring arrays, learned from in batches instead of one by one
+    # a transition's next state is the mob's own observation at the start of its next turn, so nothing
+    # is observed twice per frame; its last transition of an episode is terminal if it died, dropped if not
+
+    def __init__(self, q_table=None, species=None, capacity=100000, batch=256, every=64, seed=None):
+        self.q_table = q_table
+        self.species = species  # learning_rate and discount are read from here at update time
+        self.capacity = capacity
+        self.batch = batch  # transitions sampled per update
+        self.every = every  # transitions recorded between updates
+
+        self.state = np.zeros((capacity, 4), dtype=np.intp)  # Q_table.index() of each state
+        self.action = np.zeros(capacity, dtype=np.intp)
+        self.move_reward = np.zeros(capacity)
+        self.act_reward = np.zeros(capacity)
+        self.next_state = np.zeros((capacity, 4), dtype=np.intp)
+        self.done = np.zeros(capacity, dtype=bool)
+        self.head = 0
+        self.size = 0
+        self.added = 0
+
+        self.pending = {}  # id(mob): (mob, state, action, reward) waiting on its next state
+        self.rng = np.random.default_rng(seed)
+
+    def push(self, mob=None, q_key=None, choice=0, reward=(0, 0)):
+        state = self.q_table.index(q_key)
+        last = self.pending.get(id(mob))
+        if last is not None:
+            self.add(*last[1:], next_state=state)
+        self.pending[id(mob)] = (mob, state, choice, reward)
+
+    def add(self, state=(), action=0, reward=(0, 0), next_state=(), done=False):
+        i = self.head
+        self.state[i] = state
+        self.action[i] = action
+        self.move_reward[i], self.act_reward[i] = reward
+        self.next_state[i] = next_state
+        self.done[i] = done
+        self.head = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.added += 1
+        if self.added % self.every == 0:
+            self.learn()
+
+    def end_episode(self):
+        for mob, state, action, reward in self.pending.values():
+            if not mob.alive:
+                self.add(state, action, reward, next_state=state, done=True)
+        self.pending = {}
+
+    def learn(self):
+        # Mob.learn for a batch at once; cells hit more than once move by the mean of their updates
+        rows = self.rng.integers(0, self.size, size=min(self.batch, self.size))
+        values = self.q_table.values
+        cells = tuple(self.state[rows].T) + (self.action[rows],)
+        current_q = values[cells]
+        max_future_q = np.where(self.done[rows], 0, values[tuple(self.next_state[rows].T)].max(axis=-1))
+
+        lr, discount = self.species.learning_rate, self.species.discount
+        act_reward = self.act_reward[rows]
+        reward_sum = self.move_reward[rows] + act_reward
+        new_q = np.where(act_reward > 0, act_reward, (1 - lr) * current_q + lr * (reward_sum + discount * max_future_q))
+
+        flat = np.ravel_multi_index(cells, values.shape, mode='wrap')  # wrap: -1 is the None state
+        cells, slot, counts = np.unique(flat, return_inverse=True, return_counts=True)
+        values.reshape(-1)[cells] += np.bincount(slot, weights=new_q - current_q) / counts
+
+    def snapshot(self):
+        # checkpoints come between episodes, so nothing is pending
+        n = self.size
+        return {'state': self.state[:n].copy(), 'action': self.action[:n].copy(), 'move_reward': self.move_reward[:n].copy(),
+                'act_reward': self.act_reward[:n].copy(), 'next_state': self.next_state[:n].copy(), 'done': self.done[:n].copy(),
+                'head': self.head, 'added': self.added, 'rng': self.rng.bit_generator.state}
+
+    def restore(self, snapshot=None):
+        n = len(snapshot['action'])
+        for name in ('state', 'action', 'move_reward', 'act_reward', 'next_state', 'done'):
+            getattr(self, name)[:n] = snapshot[name]
+        self.size = n
+        self.head = snapshot['head']
+        self.added = snapshot['added']
+        self.rng.bit_generator.state = snapshot['rng']
+        self.pending = {}
@@ -0,0 +1,109 @@
+import math
+from collections import deque
+import numpy as np
+
+
+# multi-step alternatives to Mob.learn's one-step update, one object per learning mob (its own trajectory),
+# updating the mob's Q table in place; n_step=1 is exactly Mob.learn, trace_decay=0 is too up to rounding
+# as in Mob.learn, eating sets the eater's value to the meal and ends every return running through it
+
+TRACE_MIN = 0.01  # eligibility below this is dropped
+MAX_HORIZON = 1000  # most visits a trace keeps
+
+
+class NStepReturns():
+    # each (state, action) is updated once n rewards later, towards their discounted sum plus the
+    # discounted best value of the state reached after them
+
+    def __init__(self, mob=None):
+        self.mob = mob
+        self.window = deque()  # (Q table cell, reward) still waiting on n rewards
+        self.last = None  # state reached after the newest step
+
+    def step(self, q_key=None, choice=0, reward=(0, 0), new_q_key=None):
+        q_table = self.mob.q_table
+        move_reward, act_reward = reward
+        self.window.append((q_table.index(q_key) + (choice,), move_reward + act_reward))
+        self.last = new_q_key
+        if act_reward > 0:  # eating
+            cell = self.window[-1][0]
+            self.flush(bootstrap=False)
+            q_table.values[cell] = act_reward
+        elif len(self.window) >= self.mob.n_step:
+            self.update(1, bootstrap=True)
+
+    def update(self, count=1, bootstrap=True):
+        # update the oldest `count` cells in the window, each with the rewards from it to the end
+        values = self.mob.q_table.values
+        lr, discount = self.mob.learning_rate, self.mob.discount
+        future = discount * values[self.mob.q_table.index(self.last)].max() if bootstrap else 0.0
+        returns = []
+        for cell, reward in reversed(self.window):
+            future = reward + future
+            returns.append(future)
+            future *= discount
+        returns.reverse()
+        for (cell, reward), ret in zip(list(self.window)[:count], returns[:count]):
+            values[cell] = (1 - lr) * values[cell] + lr * ret
+        for _ in range(count):
+            self.window.popleft()
+
+    def flush(self, bootstrap=True):
+        if self.window:
+            self.update(len(self.window), bootstrap=bootstrap)
+
+    def end_episode(self):
+        # a dead mob's trajectory ended; a live one's was cut short, so it still bootstraps
+        self.flush(bootstrap=self.mob.alive)
+        self.last = None
+
+
+class QLambda():
+    # Watkins Q(lambda): each TD error also goes to the recently visited cells, weighted by (discount * lambda)^age,
+    # until an exploratory action cuts the trace
+    # visits older than `horizon` steps have weight below TRACE_MIN, so instead of decaying a trace table as big as
+    # the Q table every step, the last `horizon` visits are kept in a ring and weighted on the fly
+
+    def __init__(self, mob=None):
+        self.mob = mob
+        decay = mob.discount * mob.trace_decay
+        if decay <= 0:
+            self.horizon = 1
+        elif decay >= 1:
+            self.horizon = MAX_HORIZON
+        else:
+            self.horizon = min(MAX_HORIZON, int(math.ceil(math.log(TRACE_MIN) / math.log(decay))))
+        self.weights = decay ** np.arange(self.horizon)
+        self.cells = np.zeros((self.horizon, 5), dtype=np.intp)
+        self.head = 0
+        self.count = 0
+
+    def step(self, q_key=None, choice=0, reward=(0, 0), new_q_key=None):
+        q_table = self.mob.q_table
+        values = q_table.values
+        state = q_table.index(q_key)
+        cell = state + (choice,)
+        best = values[state].argmax()
+        if best != choice and best != 17:  # 17 is the greedy pick of a random move
+            self.count = 0  # exploratory: earlier visits get no credit from here on
+
+        self.cells[self.head] = cell
+        self.head = (self.head + 1) % self.horizon
+        self.count = min(self.count + 1, self.horizon)
+
+        move_reward, act_reward = reward
+        future = 0.0 if act_reward > 0 else self.mob.discount * values[q_table.index(new_q_key)].max()
+        delta = move_reward + act_reward + future - values[cell]
+
+        ages = np.arange(self.count)
+        visits = self.cells[(self.head - 1 - ages) % self.horizon]
+        np.add.at(values, tuple(visits.T), self.mob.learning_rate * delta * self.weights[ages])
+        if act_reward > 0:  # eating
+            values[cell] = act_reward
+            self.count = 0
+
+    def end_episode(self):
+        self.count = 0
+
+
+LEARNERS = {'n-step': NStepReturns, 'lambda': QLambda}
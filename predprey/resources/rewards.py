@@ -0,0 +1,232 @@
+import json
+import os
+import struct
+import numpy as np
+
+
+class RewardLog():
+    # per-episode reward table: one fixed-size record per episode holding its frame count, epsilon and every
+    # mob's total; records are appended to a binary file in batches (or kept in memory with no filename)
+    # file layout, as for Q tables: MAGIC, uint16 version, uint32 header length, JSON header, padding to ALIGN, records
+    MAGIC = b'PPREWARD'
+    VERSION = 1
+    ALIGN = 64
+    BATCH = 100  # episodes held before a write
+
+    def __init__(self, mobs=None, filename=None, batch=BATCH, append=False, window=50, points=2000):
+        self.filename = filename
+        self.batch = batch
+        self.window = window
+        self.points = points
+        self.mobs = [mob for mob_list in mobs.values() for mob in mob_list]
+        self.col = {id(mob): num for num, mob in enumerate(self.mobs)}
+        self.names = ['{}-{}'.format(mob_type, num) for mob_type, mob_list in mobs.items() for num, mob in enumerate(mob_list)]
+        self.dtype = np.dtype([('episode', '<i8'), ('frames', '<i8'), ('epsilon', '<f8')] + [(name, '<f8') for name in self.names])
+
+        self.row = [0.0] * len(self.mobs)  # running totals for the episode in progress
+        self.trends = [RewardTrend(window=window, points=points) for mob in self.mobs]
+        self.pending = []  # finished records not yet written
+        self.kept = []  # every finished record, when there is no file
+        self.written = 0
+        if self.filename and append and os.path.exists(self.filename):
+            self.reopen()
+        elif self.filename:
+            self.create()
+
+    def __len__(self):
+        # finished episodes
+        return self.written + len(self.pending) + sum(len(records) for records in self.kept)
+
+    def add(self, mob=None, reward=0):
+        self.row[self.col[id(mob)]] += reward
+
+    def current(self, mob=None):
+        return self.row[self.col[id(mob)]]
+
+    def end_episode(self, episode=0, frames=0, epsilon=0):
+        self.append(episode=episode, frames=frames, epsilon=epsilon, totals=self.row)
+        self.row = [0.0] * len(self.mobs)
+
+    def append(self, episode=0, frames=0, epsilon=0, totals=()):
+        self.pending.append((episode, frames, epsilon) + tuple(totals))
+        for trend, total in zip(self.trends, totals):
+            trend.add(total)
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        records = np.array(self.pending, dtype=self.dtype)
+        self.pending = []
+        if not self.filename:
+            self.kept.append(records)
+            return
+        with open(self.filename, 'ab') as f:
+            f.write(records.tobytes())
+        self.written += len(records)
+
+    def records(self):
+        # every finished episode, flushed or not
+        if self.filename:
+            done = read_rewards(self.filename)[:self.written]
+        else:
+            done = np.concatenate(self.kept) if self.kept else np.zeros(0, dtype=self.dtype)
+        if self.pending:
+            done = np.concatenate([done, np.array(self.pending, dtype=self.dtype)])
+        return done
+
+    def history(self, mob=None):
+        return np.array(self.records()[self.names[self.col[id(mob)]]])
+
+    def trend(self, mob=None):
+        return self.trends[self.col[id(mob)]]
+
+    def create(self):
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        header = json.dumps({'columns': list(self.dtype.names), 'dtype': self.dtype.descr,
+                             'serials': [mob.serial for mob in self.mobs]}).encode('utf-8')
+        offset = len(self.MAGIC) + 6 + len(header)
+        with open(self.filename, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack('<HI', self.VERSION, len(header)))
+            f.write(header)
+            f.write(b'\0' * ((-offset) % self.ALIGN))
+
+    def snapshot(self):
+        # what a checkpoint needs to put the log back as it is now
+        self.flush()
+        if self.filename:
+            return {'episodes': self.written}
+        return {'episodes': len(self), 'records': self.records()}
+
+    def restore(self, snapshot=None):
+        if 'records' in snapshot:
+            self.kept = [snapshot['records']]
+            self.written = 0
+        else:
+            # the file may have run ahead of the checkpoint; drop what came after it
+            header, offset = read_header(self.filename)
+            with open(self.filename, 'r+b') as f:
+                f.truncate(offset + snapshot['episodes'] * self.dtype.itemsize)
+            self.written = snapshot['episodes']
+        self.pending = []
+        self.row = [0.0] * len(self.mobs)
+        self.retrend()
+
+    def retrend(self):
+        # rebuild the plot summaries from the records, once, after a resume
+        records = self.records()
+        self.trends = [RewardTrend(window=self.window, points=self.points) for mob in self.mobs]
+        for trend, name in zip(self.trends, self.names):
+            for total in records[name].tolist():
+                trend.add(total)
+
+    def reopen(self):
+        # continue an existing file instead of starting a new one
+        header, offset = read_header(self.filename)
+        if header['columns'] != list(self.dtype.names):
+            raise ValueError('{} was logged for other mobs ({} columns, this run has {})'.format(self.filename, len(header['columns']), len(self.dtype.names)))
+        self.written = (os.path.getsize(self.filename) - offset) // self.dtype.itemsize
+
+
+class RewardTrend():
+    # one mob's episode rewards summarised for plotting in constant memory: a running-window moving average,
+    # and both series decimated into at most `points` buckets whose width doubles whenever there are too many
+    # raw buckets keep their min and max (with where they happened), average buckets keep sums for a mean
+
+    def __init__(self, window=50, points=2000):
+        self.window = window
+        self.points = points
+        self.recent = np.zeros(window)  # ring of the last `window` rewards
+        self.total = 0.0
+        self.count = 0
+        self.width = 1
+        self.raw = []  # [key, min episode, min, max episode, max]
+        self.avg = []  # [key, sum of episodes, sum of averages, n]
+
+    def add(self, reward=0):
+        episode = self.count
+        slot = episode % self.window
+        self.total += reward - self.recent[slot]
+        self.recent[slot] = reward
+        if slot == self.window - 1:
+            self.total = self.recent.sum().item()  # drop accumulated rounding once per window
+        self.count += 1
+
+        key = episode // self.width
+        if self.raw and self.raw[-1][0] == key:
+            bucket = self.raw[-1]
+            if reward < bucket[2]:
+                bucket[1:3] = episode, reward
+            if reward > bucket[4]:
+                bucket[3:5] = episode, reward
+        else:
+            self.raw.append([key, episode, reward, episode, reward])
+
+        if self.count >= self.window:  # same span as np.convolve(..., mode='valid'), placed at the window's last episode
+            if self.avg and self.avg[-1][0] == key:
+                bucket = self.avg[-1]
+                bucket[1] += episode
+                bucket[2] += self.total / self.window
+                bucket[3] += 1
+            else:
+                self.avg.append([key, episode, self.total / self.window, 1])
+
+        if len(self.raw) > self.points:
+            self.merge()
+
+    def merge(self):
+        raw, avg = [], []
+        for bucket in self.raw:
+            key = bucket[0] // 2
+            if raw and raw[-1][0] == key:
+                if bucket[2] < raw[-1][2]:
+                    raw[-1][1:3] = bucket[1:3]
+                if bucket[4] > raw[-1][4]:
+                    raw[-1][3:5] = bucket[3:5]
+            else:
+                raw.append([key] + bucket[1:])
+        for bucket in self.avg:
+            key = bucket[0] // 2
+            if avg and avg[-1][0] == key:
+                for i in (1, 2, 3):
+                    avg[-1][i] += bucket[i]
+            else:
+                avg.append([key] + bucket[1:])
+        self.raw, self.avg = raw, avg
+        self.width *= 2
+
+    def mean(self):
+        # over the last `window` episodes, or all of them early on
+        return self.total / min(self.count, self.window) if self.count else 0.0
+
+    def series(self):
+        # (episodes, rewards) with each bucket's min and max in the order they happened, then (episodes, averages)
+        points = []
+        for key, lo_episode, lo, hi_episode, hi in self.raw:
+            points.extend(sorted({(lo_episode, lo), (hi_episode, hi)}))
+        episodes, rewards = zip(*points) if points else ((), ())
+        avg_episodes = [bucket[1] / bucket[3] for bucket in self.avg]
+        averages = [bucket[2] / bucket[3] for bucket in self.avg]
+        return (np.array(episodes), np.array(rewards)), (np.array(avg_episodes), np.array(averages))
+
+
+def read_header(filename=None):
+    with open(filename, 'rb') as f:
+        if f.read(len(RewardLog.MAGIC)) != RewardLog.MAGIC:
+            raise ValueError('{} is not a reward log'.format(filename))
+        version, length = struct.unpack('<HI', f.read(6))
+        header = json.loads(f.read(length).decode('utf-8'))
+    offset = len(RewardLog.MAGIC) + 6 + length
+    return header, offset + (-offset) % RewardLog.ALIGN
+
+
+def read_rewards(filename=None):
+    # every complete record in a reward log, as a read-only structured array; safe while the run is still writing
+    header, offset = read_header(filename)
+    dtype = np.dtype([tuple(field) for field in header['dtype']])
+    count = (os.path.getsize(filename) - offset) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=(count,))
@@ -0,0 +1,130 @@
+import math
+import numpy as np
+
+
+class Grid():
+    # uniform bucket grid over a fixed set of points, rebuilt once per frame
+    DENSE = 1 << 12  # query_many compares every query with every point below this many pairs
+
+    def __init__(self, x=(), y=(), cell=1):
+        self.cell = float(cell)
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.cells = {}
+
+        if self.x.size == 0:
+            return
+
+        cx = np.floor(self.x / self.cell).astype(np.int64)
+        cy = np.floor(self.y / self.cell).astype(np.int64)
+        order = np.lexsort((cy, cx))
+        breaks = np.flatnonzero((np.diff(cx[order]) != 0) | (np.diff(cy[order]) != 0)) + 1
+        for points in np.split(order, breaks):
+            self.cells[(cx[points[0]].item(), cy[points[0]].item())] = points
+
+        # the same buckets as flat arrays, for query_many: cell keys (ascending) and their runs in order
+        self.cx, self.cy = cx, cy
+        self.low = (cx.min(), cy.min())
+        self.span = (cx.max() - self.low[0] + 1, cy.max() - self.low[1] + 1)
+        self.order = order
+        firsts = np.concatenate([[0], breaks])
+        self.keys = (cx[order[firsts]] - self.low[0]) * self.span[1] + (cy[order[firsts]] - self.low[1])
+        self.starts = firsts
+        self.stops = np.concatenate([breaks, [order.size]])
+
+    def query(self, x=0, y=0, r=0):
+        # indices of every point within r of (x, y), ascending
+        lo_x, hi_x = int(np.floor((x - r) / self.cell)), int(np.floor((x + r) / self.cell))
+        lo_y, hi_y = int(np.floor((y - r) / self.cell)), int(np.floor((y + r) / self.cell))
+
+        found = [self.cells[(i, j)] for i in range(lo_x, hi_x + 1) for j in range(lo_y, hi_y + 1) if (i, j) in self.cells]
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+
+        points = np.concatenate(found)
+        near = (self.x[points] - x)**2 + (self.y[points] - y)**2 <= r**2
+        return np.sort(points[near])
+
+    def query_many(self, x=(), y=(), r=()):
+        # query() for many points at once: (which query, point) pairs, by query and then point,
+        # exactly the concatenated results of query(x[i], y[i], r[i])
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        r = np.broadcast_to(np.asarray(r, dtype=float), x.shape)
+        none = np.zeros(0, dtype=np.int64)
+        if self.x.size == 0 or x.size == 0:
+            return none, none
+
+        lo_x = np.floor((x - r) / self.cell).astype(np.int64)
+        hi_x = np.floor((x + r) / self.cell).astype(np.int64)
+        lo_y = np.floor((y - r) / self.cell).astype(np.int64)
+        hi_y = np.floor((y + r) / self.cell).astype(np.int64)
+
+        if x.size * self.x.size <= self.DENSE:  # few enough to test every pair, with query()'s cell box
+            near = ((lo_x[:, None] <= self.cx) & (self.cx <= hi_x[:, None]) & (lo_y[:, None] <= self.cy) & (self.cy <= hi_y[:, None])
+                    & ((self.x - x[:, None])**2 + (self.y - y[:, None])**2 <= r[:, None]**2))
+            return np.nonzero(near)
+
+        # every (query, occupied cell) in each query's box, one box offset at a time
+        owners, starts, stops = [], [], []
+        for i in range(int((hi_x - lo_x).max()) + 1):
+            for j in range(int((hi_y - lo_y).max()) + 1):
+                cx = lo_x + i - self.low[0]
+                cy = lo_y + j - self.low[1]
+                inside = (lo_x + i <= hi_x) & (lo_y + j <= hi_y) & (cx >= 0) & (cx < self.span[0]) & (cy >= 0) & (cy < self.span[1])
+                queries = np.flatnonzero(inside)
+                keys = cx[queries] * self.span[1] + cy[queries]
+                slots = np.minimum(np.searchsorted(self.keys, keys), self.keys.size - 1)
+                hit = self.keys[slots] == keys
+                owners.append(queries[hit])
+                starts.append(self.starts[slots[hit]])
+                stops.append(self.stops[slots[hit]])
+        owners = np.concatenate(owners)
+        starts = np.concatenate(starts)
+        counts = np.concatenate(stops) - starts
+        if counts.sum() == 0:
+            return none, none
+
+        # expand each (query, cell) into its points, keep those in the circle, then order them
+        owner = np.repeat(owners, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        points = self.order[np.repeat(starts, counts) + offsets]
+        near = (self.x[points] - x[owner])**2 + (self.y[points] - y[owner])**2 <= r[owner]**2
+        owner, points = owner[near], points[near]
+        order = np.lexsort((points, owner))
+        return owner[order], points[order]
+
+
+class MobIndex():
+    # per-type grids over the live mobs of a mobs dict
+    # queries are padded by how far a mob of that type can move in one frame, so anything that
+    # moved since the index was built is still found; callers re-check distances exactly
+
+    def __init__(self, mobs=None, cell=None):
+        self.mobs = mobs
+        self.grids = {}
+        self.rows = {}  # position of each grid point in its mob list
+        self.slack = {}
+        self.reach = {}  # largest radius of each type, for overlap queries
+
+        if cell == None:
+            cell = max([mob.sight for mob_list in mobs.values() for mob in mob_list] + [1])
+
+        for mob_type, mob_list in mobs.items():
+            rows = [num for num, mob in enumerate(mob_list) if mob.alive]
+            self.rows[mob_type] = np.array(rows, dtype=np.int64)
+            self.grids[mob_type] = Grid([mob_list[i].x for i in rows], [mob_list[i].y for i in rows], cell=cell)
+            self.slack[mob_type] = max([mob_list[i].speed[1] for i in rows] + [0]) + 1  # + 1 covers growth
+            self.reach[mob_type] = math.sqrt(max([mob_list[i].health for i in rows] + [0]))  # Mob.r of the biggest
+
+    def near(self, mob_type=None, x=0, y=0, r=0):
+        # list positions of mobs of mob_type that may be within r of (x, y)
+        if mob_type not in self.grids:
+            return []
+        points = self.grids[mob_type].query(x, y, r + self.slack[mob_type])
+        return self.rows[mob_type][points].tolist()
+
+    def grow(self, mob_type=None, r=0):
+        # a mob got bigger mid-frame (it ate)
+        if mob_type in self.reach:
+            self.reach[mob_type] = max(self.reach[mob_type], r)
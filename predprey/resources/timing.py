@@ -0,0 +1,54 @@
+import csv
+import json
+import os
+import time
+import numpy as np
+
+
+class PhaseTimer():
+    # wall time per (phase, mob type), aggregated and written out once per episode
+    # callers mark() before a run of phases and lap() after each one, so a lap is the time since the last mark/lap
+
+    COLUMNS = ('episode', 'phase', 'mob_type', 'calls', 'total', 'mean', 'p50', 'p99')
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.samples = {}  # (phase, mob type): [seconds, ...]
+        self.last = time.perf_counter()
+
+    def mark(self):
+        self.last = time.perf_counter()
+
+    def lap(self, phase='', mob_type='all'):
+        now = time.perf_counter()
+        self.samples.setdefault((phase, mob_type), []).append(now - self.last)
+        self.last = now
+
+    def aggregate(self, episode=0):
+        rows = []
+        for (phase, mob_type), samples in self.samples.items():
+            samples = np.array(samples)
+            rows.append({'episode': episode, 'phase': phase, 'mob_type': mob_type, 'calls': samples.size,
+                         'total': samples.sum().item(), 'mean': samples.mean().item(),
+                         'p50': np.percentile(samples, 50).item(), 'p99': np.percentile(samples, 99).item()})
+        return rows
+
+    def flush(self, episode=0):
+        # append this episode's aggregates (CSV, or JSON lines for any other extension) and start over
+        rows = self.aggregate(episode=episode)
+        self.samples = {}
+        if not self.filename or not rows:
+            return rows
+
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        new_file = not os.path.exists(self.filename)
+        with open(self.filename, 'a', newline='') as f:
+            if self.filename.endswith('.csv'):
+                writer = csv.DictWriter(f, fieldnames=self.COLUMNS)
+                if new_file:
+                    writer.writeheader()
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    f.write(json.dumps(row) + '\n')
+        return rows
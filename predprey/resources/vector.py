@@ -0,0 +1,183 @@
+import numpy as np
+
+from resources.mobs import choice_delta, step_size
+from resources.kernels import kernels
+
+
+class VectorWorld():
+    # K independent copies of one scenario, stepped in lockstep: state is (K, rows) arrays with the
+    # World row layout (types grouped in mobs dict order), and each agent row acts in every world at once
+    # the template mobs supply the per-row constants and the (shared) Q tables; every world has its own state
+    # move and check run on resources/kernels.py: numba-compiled loops when available (backend='auto'), else NumPy
+
+    def __init__(self, mobs=None, k=1, dims=(0, 0), frames=100, movers=('Food', 'Prey', 'Predator'), center=None, end_on_death=True, seed=None, backend='auto'):
+        self.k = k
+        self.move_kernel, self.eat_kernel, self.flee_kernel = kernels(backend)
+        self.dims = np.array(dims, dtype=float)
+        self.frames = frames
+        self.movers = movers
+        self.center = center
+        self.end_on_death = end_on_death
+        self.rng = np.random.default_rng(seed)
+
+        self.order = list(mobs.keys())
+        self.mobs = [mob for mob_list in mobs.values() for mob in mob_list]
+        self.types = [mob_type for mob_type, mob_list in mobs.items() for mob in mob_list]
+        self.spans = {}  # mob type: (first row, last row + 1)
+        start = 0
+        for mob_type, mob_list in mobs.items():
+            self.spans[mob_type] = (start, start + len(mob_list))
+            start += len(mob_list)
+
+        # agents are the rows with a Q table; observations, actions and rewards are (K, agents)
+        self.agents = np.array([row for row, mob in enumerate(self.mobs) if mob.q_table is not None], dtype=np.int64)
+
+        n = len(self.mobs)
+        self.health_init = np.array([mob.health_init for mob in self.mobs], dtype=float)
+        self.speed = np.array([mob.speed for mob in self.mobs], dtype=float).reshape(n, 2)
+        self.sight = np.array([mob.sight for mob in self.mobs], dtype=float)
+        self.steps = {}  # every move, precomputed per speed with the same rounding as Mob.move
+        for mob in self.mobs:
+            if mob.speed not in self.steps:
+                self.steps[mob.speed] = np.array([step_size(*choice_delta(choice=c, speed=mob.speed), speed=mob.speed) for c in range(17)])
+
+        self.x = np.zeros((k, n))
+        self.y = np.zeros((k, n))
+        self.health = np.zeros((k, n))
+        self.alive = np.ones((k, n), dtype=bool)
+        self.target = np.full((k, n), -1, dtype=np.int64)  # row of the current target, -1 for none
+        self.flee = np.full((k, n), -1, dtype=np.int64)
+        self.frame = np.zeros(k, dtype=np.int64)
+        self.episode_reward = np.zeros((k, len(self.agents)))
+        self.final_obs = None  # observation each world ended its last step on, before any auto-reset
+
+    def reset(self, worlds=None):
+        # new episode in the given worlds (all by default), placed like main.reset_mobs; returns observations
+        worlds = np.arange(self.k) if worlds is None else np.asarray(worlds)
+        if worlds.size == 0:
+            return self.observe()
+        n = len(self.mobs)
+
+        self.x[worlds] = self.rng.integers(0, int(self.dims[0]), size=(worlds.size, n), endpoint=True)
+        self.y[worlds] = self.rng.integers(0, int(self.dims[1]), size=(worlds.size, n), endpoint=True)
+        if self.center in self.spans:
+            start, stop = self.spans[self.center]
+            self.x[worlds, start:stop] = self.dims[0] / 2
+            self.y[worlds, start:stop] = self.dims[1] / 2
+
+        self.health[worlds] = self.health_init
+        self.alive[worlds] = True
+        self.target[worlds] = -1
+        self.flee[worlds] = -1
+        self.frame[worlds] = 0
+        self.episode_reward[worlds] = 0
+
+        return self.observe()
+
+    def observe(self):
+        # (K, agents, 4) state indices: target quad, target band, flee quad, flee band; -1 for None
+        obs = np.full((self.k, len(self.agents), 4), -1, dtype=np.int64)
+        worlds = np.arange(self.k)
+        for col, row in enumerate(self.agents):
+            mob = self.mobs[row]
+            delta = self.speed[row, 1] + self.speed[row, 0]  # how much closer to switch targets/flee
+            for links, mob_type, key in ((self.target, mob.target[0], 0), (self.flee, mob.flee[0], 2)):
+                if mob_type not in self.spans:
+                    continue
+                links[:, row] = self.closest(row, mob_type, links[:, row], delta)
+
+                other = links[:, row]
+                seen = other >= 0
+                dx = np.where(seen, self.x[worlds, other.clip(0)] - self.x[:, row], np.nan)
+                dy = np.where(seen, self.y[worlds, other.clip(0)] - self.y[:, row], np.nan)
+                gone = (dx**2 + dy**2) ** 0.5 > self.sight[row]  # drop anything out of sight
+                links[gone, row] = -1
+                dx[gone] = np.nan
+                dy[gone] = np.nan
+                obs[:, col, key], obs[:, col, key + 1] = mob.q_table.discretize(dx, dy)
+
+        return obs
+
+    def closest(self, row, mob_type, current, delta):
+        # Mob.closest in every world at once: scan candidates in order, switching only when closer by delta
+        start, stop = self.spans[mob_type]
+        if start == stop:
+            return current
+        worlds = np.arange(self.k)
+        ds = ((self.x[:, start:stop] - self.x[:, [row]])**2 + (self.y[:, start:stop] - self.y[:, [row]])**2) ** 0.5
+        alive = self.alive[:, start:stop]
+
+        has = current >= 0
+        limit = np.where(has, ds[worlds, (current - start).clip(0)] - delta, np.inf)
+        pos = np.zeros(self.k, dtype=np.int64)
+        cols = np.arange(stop - start)
+        while True:
+            hits = alive & (ds < limit[:, None]) & (cols >= pos[:, None])
+            found = hits.any(axis=1)
+            if not found.any():
+                break
+            first = hits.argmax(axis=1)
+            current = np.where(found, start + first, current)
+            limit = np.where(found, ds[worlds, first] - delta, limit)
+            pos = np.where(found, first + 1, stop - start)
+
+        return current
+
+    def step(self, actions=None):
+        # apply one (K, agents) array of choices (17 is random), then auto-reset finished worlds
+        # returns observations, (K, agents) rewards and (K,) episode-done flags
+        actions = np.asarray(actions, dtype=np.int64).reshape(self.k, len(self.agents))
+        rewards = np.zeros((self.k, len(self.agents)))
+
+        if 'Food' in self.spans and 'Food' in self.movers:
+            start, stop = self.spans['Food']
+            self.health[:, start:stop] += np.where(self.alive[:, start:stop], 0.2, 0)  # grow!
+
+        for col, row in enumerate(self.agents):
+            if self.types[row] not in self.movers:
+                continue
+            acting = self.alive[:, row].copy()
+            choice = actions[:, col]
+            choice = np.where(choice == 17, self.rng.integers(0, 17, size=self.k), choice)  # random
+            mx, my = self.move(row, choice, acting)
+            rewards[:, col] = np.where(acting, self.check(row, mx, my, acting), 0)
+
+        self.frame += 1
+        self.episode_reward += rewards
+        done = self.frame >= self.frames
+        if self.end_on_death:
+            done |= ~self.alive.all(axis=1)  # die when one of the mobs does
+
+        self.final_obs = self.observe()
+        obs = self.final_obs
+        if done.any():
+            obs = self.reset(np.flatnonzero(done))
+
+        return obs, rewards, done
+
+    def move(self, row, choice, acting):
+        return self.move_kernel(self.x, self.y, row, self.steps[self.mobs[row].speed], choice, acting, self.dims[0], self.dims[1])
+
+    def check(self, row, mx, my, acting):
+        mob = self.mobs[row]
+        reward = -1 - (mx**2 + my**2) ** 0.5  # turn and move penalty
+
+        if mob.target[0] in self.spans:
+            start, stop = self.spans[mob.target[0]]
+            self.eat_kernel(self.x, self.y, self.health, self.alive, self.target, self.health_init, row, start, stop, acting, reward)
+        if mob.flee[0] in self.spans:
+            start, stop = self.spans[mob.flee[0]]
+            self.flee_kernel(self.x, self.y, self.health, self.alive, self.health_init, row, start, stop, reward)
+
+        return reward
+
+    def choose(self, obs=None, epsilon=0):
+        # epsilon-greedy choices from each agent's Q table for a batch of observations, like Mob.choose
+        actions = np.zeros((self.k, len(self.agents)), dtype=np.int64)
+        for col, row in enumerate(self.agents):
+            q_table = self.mobs[row].q_table
+            tq, tb, fq, fb = obs[:, col].T
+            greedy = q_table.values[tq, tb, fq, fb].argmax(axis=1)
+            explore = self.rng.random(self.k) <= epsilon
+            actions[:, col] = np.where(explore, self.rng.integers(0, 17, size=self.k), greedy)
+        return actions
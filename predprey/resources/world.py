@@ -0,0 +1,460 @@
+import numpy as np
+
+from resources.mobs import choice_delta, step_size
+from resources.spatial import Grid
+
+
+class World():
+    # structure-of-arrays twin of the mobs dict: one row per mob, rows grouped by type in dict order
+    # each type takes its turn as one batch (see act): observing, choosing and moving are array ops over
+    # all of its rows, and only meals, which change what later rows see, are settled row by row
+    CHUNK = 1 << 20  # candidate distances held at once when scanning without an index
+
+    def __init__(self, mobs=None, dims=(0, 0), spatial=False, timer=None):
+        self.dims = dims
+        self.spatial = spatial
+        self.timer = timer  # PhaseTimer, or None when not timing
+        self.grids = {}  # mob type: (grid, rows in the grid)
+        self.slack = {}  # mob type: query padding, as MobIndex.slack
+        self.reach = {}  # mob type: largest radius, as MobIndex.reach
+        self.order = list(mobs.keys())
+        self.mobs = [mob for mob_list in mobs.values() for mob in mob_list]
+        self.row = {id(mob): row for row, mob in enumerate(self.mobs)}
+
+        n = len(self.mobs)
+        self.spans = {}  # mob type: (first row, last row + 1)
+        start = 0
+        for mob_type, mob_list in mobs.items():
+            self.spans[mob_type] = (start, start + len(mob_list))
+            start += len(mob_list)
+
+        self.x = np.zeros(n)
+        self.y = np.zeros(n)
+        self.health = np.zeros(n)
+        self.health_init = np.array([mob.health_init for mob in self.mobs], dtype=float)
+        self.alive = np.ones(n, dtype=bool)
+        self.speed = np.array([mob.speed for mob in self.mobs], dtype=float).reshape(n, 2)
+        self.sight = np.array([mob.sight for mob in self.mobs], dtype=float)
+        self.cell = max(self.sight.max(initial=0), 1)
+        self.target = np.full(n, -1, dtype=np.int64)  # row of the current target, -1 for none
+        self.flee = np.full(n, -1, dtype=np.int64)
+        self.reward = np.zeros(n)  # running total for the episode
+
+        # every move a mob can make, precomputed per speed with the same rounding as Mob.move
+        speeds = list(dict.fromkeys(mob.speed for mob in self.mobs))
+        self.steps = np.array([[step_size(*choice_delta(choice=c, speed=speed), speed=speed) for c in range(17)]
+                               for speed in speeds], dtype=float).reshape(len(speeds), 17, 2)
+        self.pace = np.array([speeds.index(mob.speed) for mob in self.mobs], dtype=np.int64)  # row into steps
+
+        # during a type's turn: who was alive as it began, and the turn position of whoever ate each row
+        self.was_alive = self.alive.copy()
+        self.eaten_at = np.zeros(n, dtype=np.int64)
+
+        self.pull()
+
+    def pull(self):
+        # read mob objects into the arrays, e.g. after reset_mobs()
+        for row, mob in enumerate(self.mobs):
+            self.x[row] = mob.x
+            self.y[row] = mob.y
+            self.health[row] = mob.health
+            self.alive[row] = mob.alive
+            self.target[row] = self.row[id(mob.target[1])] if mob.target[1] is not None else -1
+            self.flee[row] = self.row[id(mob.flee[1])] if mob.flee[1] is not None else -1
+        self.reward[:] = 0
+
+    def push(self, moves=False):
+        # write the arrays back onto the mob objects for rendering and reporting
+        for row, mob in enumerate(self.mobs):
+            mob.x = self.x[row].item()
+            mob.y = self.y[row].item()
+            mob.health = self.health[row].item()
+            mob.alive = bool(self.alive[row])
+            mob.target[1] = self.mobs[self.target[row]] if self.target[row] >= 0 else None
+            mob.flee[1] = self.mobs[self.flee[row]] if self.flee[row] >= 0 else None
+            if moves:
+                mob.record()
+
+    def tally(self, rewards=None, episode=0):
+        for row, mob in enumerate(self.mobs):
+            rewards.add(mob, self.reward[row].item())
+
+    def step(self, epsilon=0, update_types=(), update_q_tables=()):
+        # advance one frame, visiting mobs in the same order as main.mob_update
+        end_episode = False
+        lap = self.timer.lap if self.timer else None
+        if lap: self.timer.mark()
+        if self.spatial:
+            self.index()
+            if lap: lap('index')
+
+        for mob_type in self.order:
+            start, stop = self.spans[mob_type]
+            if start == stop:
+                continue
+
+            alive = self.alive[start:stop]
+            if not alive.all():
+                end_episode = True  # die when one of the mobs does
+            if mob_type == 'Food':  # passive, so the whole type updates at once
+                if mob_type in update_types:
+                    self.health[start:stop][alive] += 0.2  # grow!
+                if lap: lap('action', mob_type)
+            elif mob_type in update_types and alive.any():
+                self.act(start + np.flatnonzero(alive), epsilon=epsilon, learn=mob_type in update_q_tables, lap=lap)
+
+        return end_episode
+
+    def act(self, rows, epsilon=0, learn=False, lap=None):
+        # one type's turn, as if its rows acted one after another: while they move, the types they
+        # look at stand still and can only be eaten, so a row's observation goes stale only when a
+        # meal removes a mob it picked on the way to its target (see scan), and only those rows look again
+        # rows are taken in batches that end before any row whose Q values an earlier row of the batch
+        # learns on (see batch_end); a batch's random draws are redone when a redone choice changes
+        # whether a draw is made, so every draw still lands on the same mob
+        mob = self.mobs[rows[0]]
+        mob_type = mob.__class__.__name__
+        rng = mob.rng
+        trace = getattr(mob, 'trace', None)  # predators only, as in Predator.action
+        target, flee = mob.target[0], mob.flee[0]
+        eats_first = flee is None or target is not None and self.order.index(target) < self.order.index(flee)
+        k = rows.size
+        turn = np.arange(k)
+        self.was_alive = self.alive.copy()
+        self.eaten_at[:] = k
+
+        # Q tables by row, and how learning could reach a later row's choice through a shared one
+        ids = {}
+        codes = np.array([ids.setdefault(id(self.mobs[row].q_table), len(ids)) for row in rows.tolist()])
+        tables = list({id(self.mobs[row].q_table): self.mobs[row].q_table for row in rows.tolist()}.values())
+        shared = np.bincount(codes)[codes] > 1
+        replay = learn and mob.q_table.replay is not None
+        spread = None if not learn or replay else 'state' if mob.learner == 'one-step' else 'table'
+        flush = self.flushes(rows, codes, tables, shared) if replay else np.zeros(k, dtype=bool)
+        keyed = spread is not None and shared.any()
+        whole = not keyed and not flush.any()  # nothing learned in the turn reaches another row's choice
+
+        if lap: self.timer.mark()
+        start_target = self.target[rows]
+        targets, picks = self.scan(rows, target, start_target, turn - 1)
+        targets = self.sighted(rows, targets)
+        flees = self.sighted(rows, self.scan(rows, flee, self.flee[rows], turn - 1)[0])
+        states = self.states(rows, targets, flees)
+        greedy = self.greedy(states, codes, tables, shared)
+        keys = self.keys(states, codes, shared, spread, mob.q_table.shape) if keyed else None
+        if lap: lap('observe', mob_type)
+
+        chosen = np.zeros(k, dtype=np.int64)
+        explored = np.zeros(k, dtype=bool)
+        drawn_for = np.zeros(k, dtype=np.int64)  # the greedy action each row's draw was made with
+        nx, ny, mx, my = np.zeros(k), np.zeros(k), np.zeros(k), np.zeros(k)
+        hungry = np.zeros(k, dtype=bool)  # overlapping a live target after moving
+        meals = np.zeros(k)
+        ate = np.zeros(k, dtype=np.int64)
+        health = self.health[rows]  # before any meals
+
+        p = 0
+        while p < k:
+            if lap: self.timer.mark()
+            e = k if whole else self.batch_end(p, keys, flush)
+            if shared[p:e].any():  # earlier batches may have learned on these
+                greedy[p:e] = self.greedy(states[p:e], codes[p:e], tables, shared[p:e])
+            snapshot = rng.mark()
+            chosen[p:e], explored[p:e] = rng.choices(greedy[p:e], epsilon)
+            drawn_for[p:e] = greedy[p:e]
+            drawn = e
+            nx[p:e], ny[p:e], mx[p:e], my[p:e] = self.moved(rows[p:e], chosen[p:e])
+            hungry[p:e] = self.overlaps(rows[p:e], target, nx[p:e], ny[p:e], self.health[rows[p:e]]) > 0
+            if lap: lap('action', mob_type)
+
+            # meals in row order
+            i = p
+            while True:
+                found = np.flatnonzero(hungry[i:e])
+                if found.size == 0:
+                    break
+                i += found[0]
+                self.x[rows[i]], self.y[rows[i]] = nx[i], ny[i]
+                meals[i], eaten = self.eat(rows[i], target)
+                ate[i] = len(eaten)
+                self.eaten_at[eaten] = i
+                stale = i + 1 + np.flatnonzero(np.isin(picks[i+1:], eaten).any(axis=1)) if eaten else turn[:0]
+                i += 1
+                if stale.size == 0:
+                    continue
+
+                # look again from where they stood, with this meal gone
+                found_targets, found_picks = self.scan(rows[stale], target, start_target[stale], stale - 1)
+                targets[stale] = self.sighted(rows[stale], found_targets)
+                picks = self.repick(picks, stale, found_picks)
+                states[stale] = self.states(rows[stale], targets[stale], flees[stale])
+                greedy[stale] = self.greedy(states[stale], codes[stale], tables, shared[stale])
+                if keyed:
+                    keys[stale] = self.keys(states[stale], codes[stale], shared[stale], spread, mob.q_table.shape, stale)
+                    e = min(e, self.batch_end(p, keys, flush))
+
+                redo = stale[(stale < e) & (greedy[stale] != drawn_for[stale])]
+                if redo.size == 0:
+                    continue
+                if ((explored[redo] | (greedy[redo] == 17)) == (explored[redo] | (drawn_for[redo] == 17))).all():
+                    redo = redo[~explored[redo] & (greedy[redo] != 17)]  # same draws, so only greedy picks change
+                    chosen[redo] = drawn_for[redo] = greedy[redo]
+                else:
+                    rng.rewind(snapshot)
+                    chosen[p:e], explored[p:e] = rng.choices(greedy[p:e], epsilon)
+                    drawn_for[p:e] = greedy[p:e]
+                    drawn = e
+                    redo = turn[i:e]
+                nx[redo], ny[redo], mx[redo], my[redo] = self.moved(rows[redo], chosen[redo])
+                hungry[redo] = self.overlaps(rows[redo], target, nx[redo], ny[redo], self.health[rows[redo]]) > 0
+
+            if drawn != e:  # the batch was cut short after its draws, so draw for just the rows in it
+                rng.rewind(snapshot)
+                rng.choices(greedy[p:e], epsilon)
+
+            batch = rows[p:e]
+            self.x[batch], self.y[batch] = nx[p:e], ny[p:e]
+            self.target[batch] = np.where(ate[p:e] > 0, -1, targets[p:e])
+            self.flee[batch] = flees[p:e]
+            penalties = self.overlaps(batch, flee, nx[p:e], ny[p:e], self.health[batch] if eats_first else health[p:e])
+            move_rewards = -1 - np.sqrt(mx[p:e]**2 + my[p:e]**2)  # turn and move penalties
+            act_rewards = meals[p:e] - penalties * self.health_init[batch]  # pentalty for being eaten
+            self.reward[batch] += move_rewards + act_rewards
+            if trace is not None:
+                for row, choice, x, y, count in zip(batch.tolist(), chosen[p:e].tolist(), mx[p:e].tolist(), my[p:e].tolist(), ate[p:e].tolist()):
+                    trace.add(self.mobs[row].serial, trace.MOVE, choice, x, y)
+                    if count:
+                        trace.add(self.mobs[row].serial, trace.ATE, count)
+            if lap: lap('check', mob_type)
+
+            if learn:
+                self.learn(batch, turn[p:e], states[p:e], chosen[p:e], move_rewards, act_rewards, replay)
+                if lap: lap('update_q', mob_type)
+            p = e
+
+    def learn(self, rows, turn, states, chosen, move_rewards, act_rewards, replay=False):
+        # Mob.update_q for a batch, in row order
+        q_keys = [((a, b), (c, d)) for a, b, c, d in states.tolist()]
+        rewards = list(zip(move_rewards.tolist(), act_rewards.tolist()))
+        if replay:
+            for row, q_key, choice, reward in zip(rows.tolist(), q_keys, chosen.tolist(), rewards):
+                self.mobs[row].q_table.replay.push(mob=self.mobs[row], q_key=q_key, choice=choice, reward=reward)
+            return
+
+        mob = self.mobs[rows[0]]
+        self.target[rows] = self.sighted(rows, self.scan(rows, mob.target[0], self.target[rows], turn)[0])
+        self.flee[rows] = self.sighted(rows, self.scan(rows, mob.flee[0], self.flee[rows], turn)[0])
+        new_q_keys = [((a, b), (c, d)) for a, b, c, d in self.states(rows, self.target[rows], self.flee[rows]).tolist()]
+        for row, q_key, choice, reward, new_q_key in zip(rows.tolist(), q_keys, chosen.tolist(), rewards, new_q_keys):
+            self.mobs[row].learn(q_key=q_key, choice=choice, reward=reward, new_q_key=new_q_key)
+
+    def index(self):
+        # rebuild the per-type grids from the live rows at the start of the frame
+        for mob_type, (start, stop) in self.spans.items():
+            rows = start + np.flatnonzero(self.alive[start:stop])
+            self.grids[mob_type] = (Grid(self.x[rows], self.y[rows], cell=self.cell), rows)
+            self.slack[mob_type] = self.speed[rows, 1].max(initial=0) + 1  # + 1 covers growth
+            self.reach[mob_type] = np.sqrt(self.health[rows].max(initial=0))  # raised by eat()
+
+    def near(self, row, mob_type, r=0):
+        # candidate rows of mob_type, ascending; everything when there is no index
+        start, stop = self.spans[mob_type]
+        if not self.spatial:
+            return np.arange(start, stop)
+        grid, rows = self.grids[mob_type]
+        return rows[grid.query(self.x[row], self.y[row], r + self.slack[mob_type])]
+
+    def around(self, rows, mob_type, r=(), x=(), y=()):
+        # near() for many rows at (x, y): (positions in rows, candidates, distances), a chunk at a time
+        # so the brute-force matrix stays small; without an index the candidates are one row shared by
+        # every query, with one they are -1 padded, at an infinite distance
+        start, stop = self.spans[mob_type]
+        if not self.spatial:
+            step = max(1, self.CHUNK // max(stop - start, 1))
+            others = np.arange(start, stop)
+            for i in range(0, rows.size, step):
+                sel = slice(i, i + step)
+                yield sel, others, np.sqrt((self.x[others] - x[sel, None])**2 + (self.y[others] - y[sel, None])**2)
+            return
+
+        grid, found = self.grids[mob_type]
+        owner, points = grid.query_many(x, y, r + self.slack[mob_type])
+        counts = np.bincount(owner, minlength=rows.size)
+        slot = np.arange(owner.size) - np.repeat(np.cumsum(counts) - counts, counts)
+        others = np.full((rows.size, counts.max(initial=0)), -1, dtype=np.int64)
+        others[owner, slot] = found[points]
+        ds = np.full(others.shape, np.inf)
+        ds[owner, slot] = np.sqrt((self.x[others[owner, slot]] - x[owner])**2 + (self.y[others[owner, slot]] - y[owner])**2)
+        yield slice(0, rows.size), others, ds
+
+    def overlaps(self, rows, mob_type, x=(), y=(), health=()):
+        # how many live mobs of mob_type each row touches at (x, y) with the given health, as in check
+        counts = np.zeros(rows.size, dtype=np.int64)
+        if mob_type is None:
+            return counts
+        r = np.sqrt(health)
+        for sel, others, ds in self.around(rows, mob_type, r + self.reach.get(mob_type, 0), x, y):
+            reach = np.sqrt(self.health[others]) + r[sel, None]
+            counts[sel] = np.count_nonzero((others >= 0) & self.alive[others] & (ds < reach), axis=1)
+        return counts
+
+    def scan(self, rows, mob_type, current, turn=()):
+        # Mob.closest for many rows at once, each seeing mob_type as it was just after its turn in act,
+        # i.e. without the mobs eaten by then; returns the new links and each row's picks (-1 padded),
+        # the candidates it switched to on the way
+        # a pick is closer than every live candidate before it, so the scan only has to visit those
+        # records; a mob that was never picked can be eaten without changing the result
+        links = current.copy()
+        picks = np.zeros((rows.size, 0), dtype=np.int64)
+        if mob_type is None:
+            return links, picks
+        x, y = self.x[rows], self.y[rows]
+        delta = self.speed[rows, 1] + self.speed[rows, 0]  # how much closer to switch targets/flee
+        ds = np.sqrt((self.x[current] - x)**2 + (self.y[current] - y)**2)
+        limit = np.where(current >= 0, ds - delta, np.inf)
+
+        for sel, others, ds in self.around(rows, mob_type, self.sight[rows], x, y):
+            live = (others >= 0) & self.was_alive[others] & (self.eaten_at[others] > turn[sel, None])
+            ds = np.where(live, ds, np.inf)
+            before = np.full(ds.shape, np.inf)  # nearest live candidate so far
+            before[:, 1:] = np.minimum.accumulate(ds, axis=1)[:, :-1]
+            owner, col = np.nonzero((ds < before) & (ds < limit[sel, None]))
+
+            # line each row's records up from the left, then follow them
+            counts = np.bincount(owner, minlength=ds.shape[0])
+            slot = np.arange(owner.size) - np.repeat(np.cumsum(counts) - counts, counts)
+            cands = np.full((ds.shape[0], counts.max(initial=0)), -1, dtype=np.int64)
+            dists = np.full(cands.shape, np.inf)
+            cands[owner, slot] = others[col] if others.ndim == 1 else others[owner, col]
+            dists[owner, slot] = ds[owner, col]
+            chunk_links, chunk_limit, chunk_delta = links[sel], limit[sel], delta[sel]
+            for j in range(cands.shape[1]):
+                take = dists[:, j] < chunk_limit
+                chunk_links = np.where(take, cands[:, j], chunk_links)
+                chunk_limit = np.where(take, dists[:, j] - chunk_delta, chunk_limit)
+                cands[~take, j] = -1
+            links[sel] = chunk_links
+            picks = self.repick(picks, np.arange(rows.size)[sel], cands)
+
+        return links, picks
+
+    @staticmethod
+    def repick(picks, stale, found):
+        # write rescanned rows' picks into the picks matrix, widening it if they need more columns
+        if found.shape[1] > picks.shape[1]:
+            picks = np.concatenate([picks, np.full((picks.shape[0], found.shape[1] - picks.shape[1]), -1, dtype=np.int64)], axis=1)
+        picks[stale] = -1
+        picks[stale, :found.shape[1]] = found
+        return picks
+
+    def offsets(self, rows, links):
+        # (dx, dy) from each row to its link, NaN where there is none
+        has = links >= 0
+        dx = np.where(has, self.x[links] - self.x[rows], np.nan)
+        dy = np.where(has, self.y[links] - self.y[rows], np.nan)
+        return dx, dy
+
+    def sighted(self, rows, links):
+        # drop anything that went out of sight without a better candidate
+        dx, dy = self.offsets(rows, links)
+        return np.where(np.sqrt(dx**2 + dy**2) > self.sight[rows], -1, links)
+
+    def states(self, rows, targets, flees):
+        # Q table index of each row's (target, flee) state, -1 for None, as observe's q_key
+        if rows.size == 0:
+            return np.zeros((0, 4), dtype=np.int64)
+        dx, dy = self.offsets(np.concatenate([rows, rows]), np.concatenate([targets, flees]))
+        quad, band = self.mobs[rows[0]].q_table.discretize(dx, dy)  # bins are the same for every mob of a type
+        return np.stack([quad[:rows.size], band[:rows.size], quad[rows.size:], band[rows.size:]], axis=1)
+
+    def greedy(self, states, codes, tables, shared):
+        # Mob.choose's argmax for each row: one lookup per shared table, one per row otherwise
+        greedy = np.zeros(codes.size, dtype=np.int64)
+        for code in np.unique(codes[shared]).tolist():
+            same = shared & (codes == code)
+            greedy[same] = tables[code].values[tuple(states[same].T)].argmax(axis=1)
+        for i in np.flatnonzero(~shared).tolist():
+            greedy[i] = tables[codes[i]].values[tuple(states[i].tolist())].argmax()
+        return greedy
+
+    @staticmethod
+    def keys(states, codes, shared, spread=None, shape=(), turn=None):
+        # what each row's choice reads that an earlier row's learning might write: its state in its table
+        # (spread 'state', one-step updates) or its whole table ('table', multi-step updates); rows that
+        # read nothing another row writes get keys of their own
+        turn = np.arange(codes.size) if turn is None else turn
+        keys = -1 - turn
+        if spread == 'state':
+            flat = np.ravel_multi_index(tuple(states.T), shape[:4], mode='wrap')  # wrap: -1 is the None state
+            keys = np.where(shared, codes * int(np.prod(shape[:4])) + flat, keys)
+        elif spread == 'table':
+            keys = np.where(shared, codes, keys)
+        return keys
+
+    @staticmethod
+    def batch_end(p, keys, flush):
+        # end of the batch starting at p: before the first row whose key an earlier row in it has,
+        # and just after the first row whose replay push makes a shared table learn
+        end = flush.size
+        if keys is not None:
+            order = np.argsort(keys[p:], kind='stable')
+            repeats = np.flatnonzero(keys[p:][order][1:] == keys[p:][order][:-1]) + 1
+            if repeats.size:
+                end = p + order[repeats].min()
+        flushes = np.flatnonzero(flush[p:end])
+        if flushes.size:
+            end = p + flushes[0] + 1
+        return end
+
+    def flushes(self, rows, codes, tables, shared):
+        # rows whose ReplayBuffer.push brings on a batched update of a shared table
+        flush = np.zeros(rows.size, dtype=bool)
+        for code in np.unique(codes[shared]).tolist():
+            buffer = tables[code].replay
+            same = np.flatnonzero(codes == code)
+            adds = np.array([id(self.mobs[row]) in buffer.pending for row in rows[same].tolist()], dtype=bool)
+            flush[same] = adds & ((buffer.added + np.cumsum(adds)) % buffer.every == 0)
+        return flush
+
+    def moved(self, rows, choices):
+        # Mob.move for many rows: new positions and the steps taken, within bounds
+        steps = self.steps[self.pace[rows], choices]
+        x, y = self.x[rows], self.y[rows]
+        mx = np.where(x + steps[:, 0] < 0, 0 - x, steps[:, 0])  # left bound
+        mx = np.where(self.dims[0] < x + mx, self.dims[0] - x, mx)  # right bound
+        my = np.where(y + steps[:, 1] < 0, 0 - y, steps[:, 1])  # upper bound
+        my = np.where(self.dims[1] < y + my, self.dims[1] - y, my)  # lower bound
+        return x + mx, y + my, mx, my
+
+    def distances(self, row, rows):
+        dx = self.x[rows] - self.x[row]
+        dy = self.y[rows] - self.y[row]
+        return np.sqrt(dx**2 + dy**2)
+
+    def eat(self, row, mob_type):
+        # check's meals for one row where it now stands: its reward for them and the rows it ate
+        meal = 0
+        eaten = []
+        if mob_type is None:
+            return meal, eaten
+        eater = self.mobs[row].__class__.__name__
+        last = -1
+        while True:
+            # anything this mob could reach at its current size, past the last one eaten
+            rows = self.near(row, mob_type, np.sqrt(self.health[row]) + self.reach.get(mob_type, 0))
+            rows = rows[rows > last]
+            reach = np.sqrt(self.health[rows]) + np.sqrt(self.health[row])
+            hits = np.flatnonzero(self.alive[rows] & (self.distances(row, rows) < reach))
+            if hits.size == 0:
+                return meal, eaten
+            other = rows[hits[0]].item()
+            last = other
+
+            # eat the prey/food, be rewarded
+            self.health[row] += self.health[other]
+            meal += self.health_init[other]
+            self.health[other] = 0
+            self.alive[other] = False
+            eaten.append(other)
+            if self.spatial:  # bigger now, so more might be in reach
+                self.reach[eater] = max(self.reach[eater], np.sqrt(self.health[row]))
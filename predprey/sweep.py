@@ -0,0 +1,150 @@
+# hyperparameter sweeps, run from predprey/ like main.py:
+#   python sweep.py -m prey --episodes 2000 --param learning_rate 0.04 0.08 0.16 --param discount 0.5 0.9 --jobs 4
+#   python sweep.py -m pred --search random --samples 20 --param learning_rate 0.05 0.3 --param decay 0.999 0.9999
+
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import time
+import numpy as np
+
+import main
+from resources.mobs import Prey, Predator
+
+
+# sweepable parameters: class attributes of the learning species, or main.py globals
+SPECIES_PARAMS = ('learning_rate', 'discount', 'bands', 'slices')
+MAIN_PARAMS = {'epsilon': 'EPSILON', 'decay': 'DECAY_RATE'}
+INT_PARAMS = ('bands', 'slices')
+
+SWEEPS = 'sweeps'
+COLUMNS = ('key', 'mode', 'episodes', 'frames', 'seed') + SPECIES_PARAMS + tuple(MAIN_PARAMS) + ('final_reward', 'seconds', 'episodes_per_sec')
+
+
+def grid_configs(params=None):
+    # every combination of the listed values
+    names = list(params)
+    return [dict(zip(names, values)) for values in itertools.product(*[params[name] for name in names])]
+
+
+def random_configs(params=None, samples=1, seed=0):
+    # uniform draws between the smallest and largest listed value; the seed keeps reruns resumable
+    rng = random.Random(seed)
+    configs = []
+    for s in range(samples):
+        config = {}
+        for name, values in params.items():
+            low, high = min(values), max(values)
+            config[name] = rng.randint(int(low), int(high)) if name in INT_PARAMS else rng.uniform(low, high)
+        configs.append(config)
+    return configs
+
+
+def config_key(config=None, mode='prey', episodes=0, frames=0, seed=None):
+    return json.dumps({'mode': mode, 'episodes': episodes, 'frames': frames, 'seed': seed, 'params': config}, sort_keys=True)
+
+
+def finished_keys(filename=None):
+    if not os.path.exists(filename):
+        return set()
+    with open(filename, newline='') as f:
+        return {row['key'] for row in csv.DictReader(f)}
+
+
+def run_config(job=None):
+    # one headless training run in a pool process
+    config, mode, episodes, frames, seed, m_avg = job
+    species = Prey if main.SCENARIOS[mode]['prey'][1] else Predator
+
+    for name, value in config.items():
+        if name in SPECIES_PARAMS:
+            setattr(species, name, value)
+        else:
+            setattr(main, MAIN_PARAMS[name], value)
+    main.HEADLESS = True
+    main.SAVE_Q = False
+    main.WORKERS = 1
+    main.REWARD_LOG = False  # configs run side by side; keep each one's rewards in memory
+    main.VERBOSITY = 'quiet'
+    main.EPISODES = episodes
+    main.FRAMES = frames
+    main.SEED = seed
+    main.seed_rng(seed)
+
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+        mobs, rewards, valued_customer = main.train(mode=mode, **main.SCENARIOS[mode])
+    seconds = time.perf_counter() - start
+
+    stream = rewards.history(mobs[valued_customer][0])
+    window = min(m_avg, len(stream))
+    final_reward = float(np.mean(stream[-window:])) if window else 0.0
+
+    return config, final_reward, seconds
+
+
+def sweep(configs=(), mode='prey', episodes=0, frames=0, seed=None, m_avg=0, jobs=1, filename=None):
+    done = finished_keys(filename)
+    todo = [c for c in configs if config_key(c, mode, episodes, frames, seed) not in done]
+    print('{} configs, {} already finished, {} to run on {} jobs'.format(len(configs), len(configs) - len(todo), len(todo), jobs))
+    if not todo:
+        return
+
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    new_file = not os.path.exists(filename)
+    with open(filename, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        if new_file:
+            writer.writeheader()
+
+        work = [(config, mode, episodes, frames, seed, m_avg) for config in todo]
+        with multiprocessing.Pool(jobs, maxtasksperchild=1) as pool:  # fresh process per config, so no settings leak between runs
+            for config, final_reward, seconds in pool.imap_unordered(run_config, work):
+                row = {'key': config_key(config, mode, episodes, frames, seed), 'mode': mode, 'episodes': episodes, 'frames': frames, 'seed': seed,
+                       'final_reward': final_reward, 'seconds': seconds, 'episodes_per_sec': episodes / seconds if seconds > 0 else float('inf')}
+                row.update(config)
+                writer.writerow(row)
+                f.flush()  # a killed sweep keeps every finished config
+                print('{:<60} reward {:>10.2f}  {:>7.1f}s'.format(' '.join('{}={}'.format(k, v) for k, v in config.items()), final_reward, seconds))
+
+
+def main_sweep():
+    parser = argparse.ArgumentParser(description='''Predator/Prey hyperparameter sweeps''')
+    parser.add_argument('-m', '--mode', help='training scenario', choices=tuple(main.SCENARIOS), default=main.MODE)
+    parser.add_argument('--param', help='parameter name and values', nargs='+', action='append', default=[], metavar=('NAME', 'VALUE'))
+    parser.add_argument('--search', help='grid of listed values, or random draws within their range', choices=('grid', 'random'), default='grid')
+    parser.add_argument('--samples', help='configs to draw for a random search', type=int, default=10)
+    parser.add_argument('--jobs', help='configs run at once', type=int, default=os.cpu_count())
+    parser.add_argument('--episodes', help='training episodes per config', type=int, default=main.EPISODES)
+    parser.add_argument('--frames', help='steps per training episode', type=int, default=main.FRAMES)
+    parser.add_argument('--seed', help='random seed for every config (and the random search)', type=int, default=0)
+    parser.add_argument('--mvg-avg', help='episodes averaged for the final reward', type=int, default=main.M_AVG)
+    parser.add_argument('--out', help='results table; finished configs in it are skipped', default=None)
+    args = parser.parse_args()
+
+    params = {}
+    for name, *values in args.param:
+        if name not in SPECIES_PARAMS and name not in MAIN_PARAMS:
+            parser.error('unknown parameter {}, choose from {}'.format(name, SPECIES_PARAMS + tuple(MAIN_PARAMS)))
+        if not values:
+            parser.error('no values given for {}'.format(name))
+        params[name] = [int(v) if name in INT_PARAMS else float(v) for v in values]
+    if not params:
+        parser.error('nothing to sweep, give at least one --param')
+
+    if args.search == 'grid':
+        configs = grid_configs(params)
+    else:
+        configs = random_configs(params, samples=args.samples, seed=args.seed)
+
+    filename = args.out or os.path.join(main.RES, SWEEPS, '{}.csv'.format(args.mode))
+    sweep(configs, mode=args.mode, episodes=args.episodes, frames=args.frames, seed=args.seed, m_avg=args.mvg_avg, jobs=max(args.jobs, 1), filename=filename)
+
+
+if __name__ == '__main__':
+    main_sweep()